@@ -1,17 +1,44 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+import numpy as np
 import requests
 import re
 import os
+import functools
+import importlib.util
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import run_profiler
+from extraction_metrics import PROCESS_METRICS, PipelineMetrics
+from exam_export import FORMATS, artifact_cache, available_formats, exam_content_hash, submit_bundle
+from question_bank import QuestionBank, format_score
+from sheet_loader import load_sheets, parse_sheet_ids
+from question_writer import MODE_APPEND, MODE_UPSERT, apply_plan, open_store, plan_write
+from page_dedup import PageDeduplicator, PageHashIndex
+from page_filter import BLANK_INK, MIN_ENTROPY, PageFilter
+from extraction_jobs import ExtractionBudget, submit_extraction
+from pdf_document import PdfDocument
 
-# 嘗試導入 PDF 處理庫
-try:
-    import PyPDF2
-    from gemini_pdf_extractor import extract_legal_questions_with_gemini_vision
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id[:8] if ctx is not None else ""
+
+# 效能剖析（設定 EXAM_PROFILE_DIR 時才啟用）：整次重跑從這裡開始，到頁尾結束
+_profiled_run = run_profiler.start('rerun', session=current_session_id())
+
+# 提取量測輸出目錄（設定後每批次結束會寫入 JSON lines 與 Prometheus 文字檔）
+METRICS_DIR = os.environ.get('EXAM_METRICS_DIR')
+
+# 頁面雜湊索引檔（設定後重複頁面的提取結果可跨批次、跨重新啟動沿用）
+PAGE_INDEX_PATH = os.environ.get('PAGE_HASH_INDEX')
+
+# 檢查 PDF 處理庫是否已安裝（只查找不導入，實際使用 PDF 分頁時才載入）
+PDF_AVAILABLE = all(
+    importlib.util.find_spec(name) is not None
+    for name in ('google.generativeai', 'pdf2image', 'PIL')
+)
+
+# 相似題目功能需要 scipy（稀疏矩陣）；未安裝時隱藏相關設定
+SIMILARITY_AVAILABLE = importlib.util.find_spec('scipy') is not None
 
 # ==================== 頁面設定 ====================
 st.set_page_config(
@@ -25,78 +52,193 @@ st.title("📚 自動化雲端出卷系統")
 st.markdown("基於 Google Sheets 的智能出卷平台 | 支援 PDF 自動提取")
 
 # ==================== 初始化 Session State ====================
-if 'exam_df' not in st.session_state:
-    st.session_state.exam_df = None
-
 if 'extracted_questions' not in st.session_state:
     st.session_state.extracted_questions = []
 
+if 'extracted_df' not in st.session_state:
+    st.session_state.extracted_df = None
+    st.session_state.extracted_hash = None
+
+# 考卷只保留題庫索引；題庫本身由所有工作階段共用
+if 'generated_exam' not in st.session_state:
+    st.session_state.generated_exam = None
+    st.session_state.generated_exam_bank = None
+    st.session_state.generated_exam_hash = None
+
+if 'bundle_job' not in st.session_state:
+    st.session_state.bundle_job = None
+
+if 'write_plan' not in st.session_state:
+    st.session_state.write_plan = None
+
+if 'extraction_metrics' not in st.session_state:
+    st.session_state.extraction_metrics = PipelineMetrics()
+
+if 'page_filter_decisions' not in st.session_state:
+    st.session_state.page_filter_decisions = []
+
+# 背景提取工作與其批次設定（去重、頁面篩選、量測起點）
+if 'extraction_job' not in st.session_state:
+    st.session_state.extraction_job = None
+    st.session_state.extraction_batch = None
+
 # ==================== Google Sheets 函數 ====================
-def load_google_sheets(sheet_id):
-    """從 Google Sheets 載入題庫"""
+@st.cache_resource(show_spinner="📖 載入題庫中...", max_entries=16)
+def load_question_bank(sheet_ids):
+    """從一個或多個 Google Sheets 並行載入並合併題庫；每個程序只保留一份，所有工作階段共用"""
+    df = load_sheets(list(sheet_ids))
+    
+    # 驗證必要欄位並轉為精簡格式
+    return QuestionBank.from_dataframe(df)
+
+def reload_question_bank(sheet_input):
+    """只清除這組試算表 ID 的快取；其他工作階段載入的題庫不受影響"""
+    ids = tuple(parse_sheet_ids(sheet_input))
+    if ids:
+        load_question_bank.clear(ids)
+
+def load_google_sheets(sheet_input):
+    """載入題庫（可輸入多個以逗號分隔的 ID），失敗時顯示錯誤並回傳 None（失敗結果不會被快取）"""
     try:
-        url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv"
-        df = pd.read_csv(url)
-        
-        # 驗證必要欄位
-        required_columns = ['ID', '類型', '科目', '題目內容', '參考解答', '分數']
-        if not all(col in df.columns for col in required_columns):
-            st.error(f"❌ 試算表缺少必要欄位。需要：{', '.join(required_columns)}")
-            return None
-        
-        return df
+        return load_question_bank(tuple(parse_sheet_ids(sheet_input)))
+    except ValueError as e:
+        st.error(f"❌ {str(e)}")
+        return None
     except Exception as e:
         st.error(f"❌ 錯誤：{str(e)}")
         return None
 
 # ==================== PDF 處理函數 ====================
-def extract_legal_questions_from_pdf(pdf_file):
-    """使用 Gemini Vision AI 從 PDF 文字提取法律題目"""
-    if not PDF_AVAILABLE:
-        st.error("❌ PDF 處理庫未安裝")
-        return []
-    
+@st.cache_resource(show_spinner=False)
+def get_pdf_extractor():
+    """每個程序只建立一次 Gemini 提取器，跨檔案與工作階段共用"""
+    from gemini_pdf_extractor import get_gemini_extractor
+    return get_gemini_extractor()
+
+@st.cache_resource(show_spinner=False)
+def get_page_index():
+    """程序內共用的頁面雜湊索引"""
+    return PageHashIndex(PAGE_INDEX_PATH)
+
+def start_extraction(uploaded_files, page_filter=None, context_tail=0, budget=None, document_limits=None):
+    """在背景提取上傳的 PDF；回傳提取工作，提取器無法建立或暫存失敗時顯示錯誤並回傳 None"""
     try:
-        # 讀取 PDF 檔案
-        pdf_bytes = pdf_file.read()
-        filename = pdf_file.name
-        
-        # 使用 Gemini Vision AI 提取
-        questions = extract_legal_questions_with_gemini_vision(pdf_bytes, filename)
-        
-        return questions
+        extractor = get_pdf_extractor()
+        dedup = PageDeduplicator(get_page_index())
     except Exception as e:
         st.error(f"❌ PDF 提取失敗：{str(e)}")
-        return []
+        return None
+    
+    metrics = st.session_state.extraction_metrics
+    extract = functools.partial(
+        extractor.extract_from_pdf,
+        metrics=metrics, dedup=dedup, page_filter=page_filter, context_tail=context_tail
+    )
+    # 上傳檔案分段寫入暫存檔，背景工作只持有檔案路徑；中途失敗時刪除已寫入的暫存檔
+    files = []
+    try:
+        for f in uploaded_files:
+            files.append((f.name, PdfDocument.from_stream(f, f.name)))
+    except Exception as e:
+        for _, document in files:
+            document.close()
+        st.error(f"❌ 無法暫存上傳的 PDF：{str(e)}")
+        return None
+    
+    st.session_state.extracted_questions = []
+    st.session_state.write_plan = None
+    st.session_state.extraction_batch = {
+        'dedup': dedup,
+        'page_filter': page_filter,
+        'batch_start': len(metrics.spans),
+    }
+    st.session_state.extraction_job = submit_extraction(
+        files, extract, budget or ExtractionBudget(), document_limits,
+        profile_tags={'session': current_session_id(), 'files': len(files)}
+    )
+    return st.session_state.extraction_job
+
+# ==================== 匯出 ====================
+EXPORT_LABELS = {
+    'csv': 'CSV',
+    'docx_paper': '試題卷 DOCX',
+    'docx_answers': '解答卷 DOCX',
+    'pdf_paper': '試題卷 PDF',
+    'pdf_answers': '解答卷 PDF',
+}
+
+# ==================== 分頁顯示 ====================
+PAGE_SIZE_OPTIONS = [10, 25, 50, 100]
+
+def paginate(total, key, default_size=25):
+    """顯示分頁控制並回傳目前頁的 (start, end)；只有這一段資料會被渲染並送到瀏覽器"""
+    if total <= PAGE_SIZE_OPTIONS[0]:
+        return 0, total
+    
+    col_size, col_page, col_info = st.columns([1, 1, 2])
+    
+    with col_size:
+        page_size = st.selectbox(
+            "每頁筆數",
+            PAGE_SIZE_OPTIONS,
+            index=PAGE_SIZE_OPTIONS.index(default_size),
+            key=f"{key}_size"
+        )
+    
+    page_count = (total + page_size - 1) // page_size
+    page_key = f"{key}_page"
+    # 頁碼只由 session state 提供（元件不再指定 value，避免與 Session State API 重複設定的警告）；
+    # 篩選或每頁筆數改變後，頁碼可能超出範圍
+    if page_key not in st.session_state:
+        st.session_state[page_key] = 1
+    elif st.session_state[page_key] > page_count:
+        st.session_state[page_key] = page_count
+    
+    with col_page:
+        page = st.number_input("頁碼", min_value=1, max_value=page_count, step=1, key=page_key)
+    
+    start = (page - 1) * page_size
+    end = min(start + page_size, total)
+    
+    with col_info:
+        st.caption(f"顯示第 {start + 1}–{end} 筆，共 {total} 筆（{page_count} 頁）")
+    
+    return start, end
 
 # ==================== 核心邏輯 ====================
-def generate_exam(df, target_score, selected_subjects, selected_types):
-    """根據條件生成考卷"""
-    if df is None or df.empty:
+def generate_exam(bank, target_score, selected_subjects, selected_types, max_similarity=None):
+    """
+    根據條件生成考卷，回傳題目在題庫中的索引陣列
+    指定 max_similarity 時，與已選題目內容相似度超過此值的題目不再選入
+    """
+    if bank is None or len(bank) == 0:
         return None
     
     # 篩選題目
-    filtered_df = df[
-        (df['科目'].isin(selected_subjects)) &
-        (df['類型'].isin(selected_types))
-    ].copy()
+    candidates = bank.select(selected_subjects, selected_types)
     
-    if filtered_df.empty:
+    if len(candidates) == 0:
         return None
     
     # 隨機抽取題目
-    exam_questions = []
+    exam_indices = []
     current_score = 0
+    blocked = np.zeros(len(bank), dtype=bool) if max_similarity is not None else None
     
-    for _, row in filtered_df.iterrows():
-        if current_score + row['分數'] <= target_score:
-            exam_questions.append(row)
-            current_score += row['分數']
+    for idx, score in zip(candidates.tolist(), bank.scores[candidates].tolist()):
+        if blocked is not None and blocked[idx]:
+            continue
+        if current_score + score <= target_score:
+            exam_indices.append(idx)
+            current_score += score
+            if blocked is not None:
+                # 每選入一題只做一次稀疏查詢，標記所有太相似的候選題
+                blocked |= bank.similarity.similarities_to_text(bank.texts[idx]) > max_similarity
     
-    if not exam_questions:
+    if not exam_indices:
         return None
     
-    return pd.DataFrame(exam_questions)
+    return np.array(exam_indices, dtype=np.int32)
 
 # ==================== 主要介面 ====================
 tab1, tab2, tab3 = st.tabs(["📝 出卷系統", "📥 上傳 PDF", "📊 題庫管理"])
@@ -109,32 +251,35 @@ with tab1:
     
     with col_input:
         sheet_id = st.text_input(
-            "請輸入 Google Sheets ID",
-            placeholder="例如：1a2b3c4d5e6f7g8h9i0j",
+            "請輸入 Google Sheets ID（多個試算表以逗號分隔）",
+            placeholder="例如：1a2b3c4d5e6f7g8h9i0j, 9z8y7x6w5v4u3t2s1r0q",
             key="sheet_id_main"
         )
     
     with col_load:
         if st.button("📖 載入題庫", use_container_width=True):
-            st.cache_data.clear()
+            run_profiler.tag('load_bank')
+            reload_question_bank(sheet_id)
     
     if sheet_id:
-        df = load_google_sheets(sheet_id)
+        bank = load_google_sheets(sheet_id)
         
-        if df is not None and not df.empty:
-            st.success(f"✅ 成功載入 {len(df)} 題")
-            st.session_state.exam_df = df
+        if bank is not None and len(bank) > 0:
+            run_profiler.tag(bank_size=len(bank))
+            st.success(f"✅ 成功載入 {len(bank)} 題")
+            for warning in bank.warnings:
+                st.warning(f"⚠️ {warning}")
             
             # 顯示統計
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("總題數", len(df))
+                st.metric("總題數", len(bank))
             with col2:
-                st.metric("科目數", df['科目'].nunique())
+                st.metric("科目數", len(bank.subjects))
             with col3:
-                st.metric("題型數", df['類型'].nunique())
+                st.metric("題型數", len(bank.types))
             with col4:
-                st.metric("總分數", int(df['分數'].sum()))
+                st.metric("總分數", format_score(bank.total_score))
             
             st.markdown("---")
             
@@ -144,58 +289,123 @@ with tab1:
             with col_subject:
                 selected_subjects = st.multiselect(
                     "選擇科目",
-                    df['科目'].unique(),
-                    default=list(df['科目'].unique())
+                    bank.subjects,
+                    default=bank.subjects
                 )
             
             with col_type:
                 selected_types = st.multiselect(
                     "選擇題型",
-                    df['類型'].unique(),
-                    default=list(df['類型'].unique())
+                    bank.types,
+                    default=bank.types
                 )
             
             with col_score:
                 target_score = st.number_input(
                     "目標分數",
                     min_value=0,
-                    max_value=int(df['分數'].sum()),
+                    max_value=int(bank.total_score),
                     value=100,
                     step=5
                 )
             
+            max_similarity = 1.0
+            if SIMILARITY_AVAILABLE:
+                max_similarity = st.slider(
+                    "同卷題目內容相似度上限（1.0 表示不限制）",
+                    0.1, 1.0, 1.0, step=0.05,
+                    help="避免同一張考卷出現主題太接近的題目，例如兩題抵押權案例"
+                )
+            
             # 生成考卷
             if st.button("🎲 隨機生成考卷", use_container_width=True):
-                exam = generate_exam(df, target_score, selected_subjects, selected_types)
+                run_profiler.tag('generate_exam')
+                with st.spinner("🔍 建立相似度索引中..." if max_similarity < 1.0 and not bank.similarity_ready else "🎲 生成中..."):
+                    exam_indices = generate_exam(
+                        bank, target_score, selected_subjects, selected_types,
+                        max_similarity if max_similarity < 1.0 else None
+                    )
+                st.session_state.generated_exam = exam_indices
+                st.session_state.generated_exam_bank = bank.token
+                st.session_state.generated_exam_hash = None
                 
-                if exam is not None:
-                    st.session_state.exam_df = exam
-                    st.success(f"✅ 成功生成考卷（{len(exam)} 題，{int(exam['分數'].sum())} 分）")
-                    
-                    # 顯示考卷
-                    st.subheader("📋 考卷預覽")
-                    
-                    for i, (_, row) in enumerate(exam.iterrows(), 1):
-                        with st.expander(f"**題 {i}** ({row['科目']} | {row['類型']}) - {row['分數']} 分"):
-                            st.write(f"**題目：**\n{row['題目內容']}")
-                            st.write(f"**解答：**\n{row['參考解答']}")
-                    
-                    st.markdown("---")
-                    st.subheader("💾 匯出考卷")
-                    
-                    col_export1, col_export2 = st.columns(2)
-                    
-                    with col_export1:
-                        if st.button("📥 下載為 CSV", use_container_width=True):
-                            csv_bytes = exam.to_csv(index=False).encode('utf-8-sig')
-                            st.download_button(
-                                label="點擊下載 CSV",
-                                data=csv_bytes,
-                                file_name=f"考卷_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                mime="text/csv"
-                            )
+                if exam_indices is not None:
+                    exam = bank.take(exam_indices)
+                    st.session_state.generated_exam_hash = exam_content_hash(exam)
+                    st.success(f"✅ 成功生成考卷（{len(exam)} 題，{format_score(exam['分數'].sum())} 分）")
                 else:
                     st.warning("⚠️ 無法生成符合條件的考卷")
+            
+            # 題庫重新載入後，舊考卷的索引不再有效
+            if st.session_state.generated_exam_bank != bank.token:
+                st.session_state.generated_exam = None
+            
+            exam_indices = st.session_state.generated_exam
+            if exam_indices is not None:
+                exam = bank.take(exam_indices)
+                # 顯示考卷（只渲染目前頁的題目）
+                st.subheader("📋 考卷預覽")
+                
+                start, end = paginate(len(exam), key="exam_preview")
+                for i, (_, row) in enumerate(exam.iloc[start:end].iterrows(), start + 1):
+                    with st.expander(f"**題 {i}** ({row['科目']} | {row['類型']}) - {row['分數']} 分"):
+                        st.write(f"**題目：**\n{row['題目內容']}")
+                        st.write(f"**解答：**\n{row['參考解答']}")
+                
+                st.markdown("---")
+                st.subheader("💾 匯出考卷")
+                
+                # 每份考卷內容只渲染一次，之後的重新執行直接使用快取
+                content_hash = st.session_state.generated_exam_hash
+                formats = available_formats()
+                export_cols = st.columns(len(formats))
+                
+                for col, fmt in zip(export_cols, formats):
+                    ext, mime = FORMATS[fmt]
+                    with col:
+                        st.download_button(
+                            label=f"📥 {EXPORT_LABELS[fmt]}",
+                            data=artifact_cache.get(exam, fmt, content_hash),
+                            file_name=f"考卷_{content_hash}_{EXPORT_LABELS[fmt]}.{ext}",
+                            mime=mime,
+                            key=f"export_{fmt}",
+                            use_container_width=True
+                        )
+                
+                # 多版本打包（背景執行）
+                st.write("**📦 多版本打包**")
+                col_variants, col_formats, col_submit = st.columns([1, 2, 1])
+                
+                with col_variants:
+                    variant_count = st.number_input("版本數", min_value=1, max_value=200, value=10, step=1)
+                
+                with col_formats:
+                    bundle_formats = st.multiselect(
+                        "包含格式",
+                        formats,
+                        default=formats,
+                        format_func=lambda f: EXPORT_LABELS[f]
+                    )
+                
+                with col_submit:
+                    if st.button("📦 開始打包", use_container_width=True, disabled=not bundle_formats):
+                        run_profiler.tag('bundle')
+                        st.session_state.bundle_job = submit_bundle(exam, int(variant_count), bundle_formats, content_hash)
+                
+                job = st.session_state.bundle_job
+                if job is not None:
+                    if job.error:
+                        st.error(f"❌ 打包失敗：{job.error}")
+                    elif job.result is not None:
+                        st.download_button(
+                            label=f"📥 下載 {job.variants} 個版本（ZIP）",
+                            data=job.result,
+                            file_name=f"考卷_{content_hash}_{job.variants}版本.zip",
+                            mime="application/zip"
+                        )
+                    else:
+                        st.progress(job.progress, text=f"打包中... {job.done_steps}/{job.total_steps}")
+                        st.button("🔄 更新進度")
 
 # ==================== Tab 2: 上傳 PDF ====================
 with tab2:
@@ -212,47 +422,139 @@ with tab2:
             accept_multiple_files=True
         )
         
+        with st.expander("⚙️ 提取設定"):
+            use_page_filter = st.checkbox(
+                "略過空白頁、目錄、答案卡等不含題目的頁面（不呼叫 AI）",
+                value=True,
+                key="use_page_filter"
+            )
+            filter_blank_ink = st.slider(
+                "空白頁墨水密度門檻", 0.0, 0.05, BLANK_INK, step=0.001, format="%.3f", key="filter_blank_ink"
+            )
+            filter_min_entropy = st.slider(
+                "最低影像熵", 0.0, 2.0, MIN_ENTROPY, step=0.1, key="filter_min_entropy"
+            )
+            use_context_tail = st.checkbox(
+                "合併跨請求的題目（每次請求附上前一頁結尾，會增加輸入 token；同一次請求內的跨頁題目一律合併）",
+                value=False,
+                key="use_context_tail"
+            )
+            
+            st.write("**預算上限**（0 表示不限；超過後停止呼叫 AI，保留已提取的題目）")
+            col_doc, col_batch = st.columns(2)
+            with col_doc:
+                doc_minutes = st.number_input("每份文件時間（分鐘）", min_value=0, value=0, key="doc_minutes")
+                doc_pages = st.number_input("每份文件頁數", min_value=0, value=0, key="doc_pages")
+                doc_tokens = st.number_input("每份文件 token", min_value=0, value=0, step=10000, key="doc_tokens")
+            with col_batch:
+                batch_minutes = st.number_input("每批次時間（分鐘）", min_value=0, value=0, key="batch_minutes")
+                batch_pages = st.number_input("每批次頁數", min_value=0, value=0, key="batch_pages")
+                batch_tokens = st.number_input("每批次 token", min_value=0, value=0, step=10000, key="batch_tokens")
+        
         if uploaded_files:
             st.subheader(f"📄 已上傳 {len(uploaded_files)} 個檔案")
             
-            # 建立一個按鈕來開始分析
-            if st.button("🤖 開始分析 PDF", use_container_width=True, key="analyze_pdfs"):
-                st.session_state.extracted_questions = []
+            job = st.session_state.extraction_job
+            running = job is not None and not job.finished
+            
+            # 建立一個按鈕來開始分析（在背景執行，可隨時停止）
+            if st.button("🤖 開始分析 PDF", use_container_width=True, key="analyze_pdfs", disabled=running):
+                run_profiler.tag('start_extraction')
+                page_filter = None
+                if use_page_filter:
+                    page_filter = PageFilter(blank_ink=filter_blank_ink, min_entropy=filter_min_entropy)
+                job = start_extraction(
+                    uploaded_files,
+                    page_filter=page_filter,
+                    context_tail=None if use_context_tail else 0,  # None 表示使用提取器預設字數
+                    budget=ExtractionBudget(batch_minutes * 60, batch_pages, batch_tokens),
+                    document_limits={
+                        'deadline_seconds': doc_minutes * 60,
+                        'max_pages': doc_pages,
+                        'max_tokens': doc_tokens,
+                    },
+                )
+                running = job is not None
+            
+            if running:
+                if not job.started:
+                    status = "⏳ 排隊中（等待其他提取工作完成）..."
+                elif not job.current:
+                    status = "📄 準備中..."
+                elif job.total_pages:
+                    status = (f"📄 正在分析: {job.current} ({job.done_files + 1}/{len(job.files)})，"
+                              f"已完成 {job.done_pages}/{job.total_pages} 頁")
+                else:
+                    status = f"📄 正在分析: {job.current} ({job.done_files + 1}/{len(job.files)})"
+                st.progress(job.progress, text=status)
+                col_refresh, col_stop = st.columns(2)
+                with col_refresh:
+                    st.button("🔄 更新進度", use_container_width=True, key="extraction_refresh")
+                with col_stop:
+                    if st.button("⏹ 停止提取", use_container_width=True, key="extraction_stop",
+                                 disabled=job.budget.cancelled):
+                        job.budget.cancel()
+                        st.info("⏳ 目前頁面處理完成後停止...")
+            
+            elif job is not None and not job.collected:
+                # 工作完成後只做一次收尾
+                job.collected = True
+                batch = st.session_state.extraction_batch
+                metrics = st.session_state.extraction_metrics
+                dedup, page_filter = batch['dedup'], batch['page_filter']
+                st.session_state.extracted_questions = job.questions
                 
-                # 創建進度條
-                progress_bar = st.progress(0)
-                status_text = st.empty()
+                dedup.index.save()
+                if dedup.skipped:
+                    st.info(f"♻️ 略過 {dedup.skipped} 個重複頁面（其中 {dedup.reused} 頁沿用先前的提取結果）")
+                if page_filter is not None:
+                    st.session_state.page_filter_decisions = page_filter.decisions
+                    if page_filter.skipped:
+                        st.info(f"🧹 預先篩除 {page_filter.skipped} 個不含題目的頁面")
                 
-                # 一次處理所有 PDF
-                for idx, uploaded_file in enumerate(uploaded_files):
-                    # 更新進度
-                    progress = (idx + 1) / len(uploaded_files)
-                    progress_bar.progress(progress)
-                    status_text.write(f"📄 正在分析: {uploaded_file.name} ({idx + 1}/{len(uploaded_files)})")
-                    
-                    # 提取題目
-                    questions = extract_legal_questions_from_pdf(uploaded_file)
-                    
-                    if questions:
-                        st.session_state.extracted_questions.extend(questions)
+                if st.session_state.extracted_questions:
+                    st.session_state.extracted_df = pd.DataFrame(st.session_state.extracted_questions)
+                    st.session_state.extracted_hash = exam_content_hash(st.session_state.extracted_df)
                 
-                # 清除進度條
-                progress_bar.empty()
-                status_text.empty()
+                # 寫出量測資料（Prometheus 計數器由程序內所有工作階段共同累計）
+                PROCESS_METRICS.record(metrics.spans[batch['batch_start']:])
+                if METRICS_DIR:
+                    os.makedirs(METRICS_DIR, exist_ok=True)
+                    metrics.write_jsonl(os.path.join(METRICS_DIR, 'extraction_spans.jsonl'), since=batch['batch_start'])
+                    PROCESS_METRICS.write_prometheus(os.path.join(METRICS_DIR, 'extraction.prom'))
+                    if page_filter is not None:
+                        page_filter.write_log(os.path.join(METRICS_DIR, 'page_filter_decisions.jsonl'))
                 
                 # 顯示完成訊息
                 if st.session_state.extracted_questions:
                     st.success(f"✅ 成功提取 {len(st.session_state.extracted_questions)} 題")
+                elif job.errors or job.budget.skipped_notes():
+                    st.warning("⚠️ 未提取到任何題目，部分檔案或頁面未處理（見下方說明）。")
                 else:
                     st.warning("⚠️ 未找到任何題目。請確保 PDF 中有法律題目。")
             
+            # 提前停止或提取失敗時，說明哪些頁面沒有處理（保留到下一次分析前）
+            if job is not None and job.finished:
+                for error in job.errors:
+                    st.error(f"❌ PDF 提取失敗：{error}")
+                notes = job.budget.skipped_notes()
+                if notes:
+                    st.warning("⚠️ 以下頁面未處理，結果只包含其餘頁面：\n\n" + "\n".join(f"- {note}" for note in notes))
+            
             # 顯示已提取的題目
             if st.session_state.extracted_questions:
                 st.markdown("---")
                 st.subheader("📋 提取的題目詳情")
                 
-                # 顯示每個題目
-                for i, q in enumerate(st.session_state.extracted_questions, 1):
+                # 顯示目前頁的題目
+                keyword = st.text_input("🔎 搜尋題目", key="extracted_keyword")
+                shown = [
+                    (i, q) for i, q in enumerate(st.session_state.extracted_questions, 1)
+                    if not keyword or keyword in str(q['題目內容']) or keyword in str(q['ID'])
+                ]
+                
+                start, end = paginate(len(shown), key="extracted")
+                for i, q in shown[start:end]:
                     with st.expander(f"**題 {i}** ({q['科目']} | {q['類型']}) - {q['ID']}"):
                         st.write("**題目內容：**")
                         st.write(q['題目內容'])
@@ -266,18 +568,118 @@ with tab2:
                 st.markdown("---")
                 st.subheader("💾 匯出提取的題目")
                 
-                # 轉換為 CSV
-                df_extracted = pd.DataFrame(st.session_state.extracted_questions)
-                csv_bytes = df_extracted.to_csv(index=False).encode('utf-8-sig')
-                
+                # 匯出 CSV（提取完成後只產生一次）
                 st.download_button(
                     label="📥 下載提取的題目（CSV）",
-                    data=csv_bytes,
-                    file_name=f"提取題目_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    data=artifact_cache.get(st.session_state.extracted_df, 'csv', st.session_state.extracted_hash),
+                    file_name=f"提取題目_{st.session_state.extracted_hash}.csv",
                     mime="text/csv"
                 )
                 
-                st.info("💡 提示：下載 CSV 後，可以在 Google Sheets 中匯入這些題目。")
+                st.info("💡 提示：下載 CSV 後，可以在 Google Sheets 中匯入這些題目，或使用下方的「寫回題庫」。")
+                
+                # 寫回題庫：先預覽差異，確認後分批寫入
+                st.markdown("---")
+                st.subheader("📤 寫回題庫")
+                
+                col_target, col_prefix, col_mode = st.columns([2, 1, 1])
+                with col_target:
+                    target_sheet = st.text_input("目標 Google Sheets ID", key="write_target")
+                with col_prefix:
+                    # 提取的 ID 已包含檔案雜湊與頁碼，不同檔案與批次不會重複；前綴只用於分類
+                    id_prefix = st.text_input("ID 前綴（選填）", key="write_prefix")
+                with col_mode:
+                    write_mode = st.radio(
+                        "寫入方式",
+                        [MODE_UPSERT, MODE_APPEND],
+                        format_func=lambda m: '新增並更新' if m == MODE_UPSERT else '只新增',
+                        key="write_mode"
+                    )
+                
+                if target_sheet and st.button("🔍 預覽差異", use_container_width=True):
+                    run_profiler.tag('write_preview')
+                    try:
+                        store = open_store(parse_sheet_ids(target_sheet)[0])
+                        new_questions = st.session_state.extracted_df.assign(
+                            ID=id_prefix + st.session_state.extracted_df['ID'].astype(str)
+                        )
+                        # 計畫連同產生它的提取結果與設定一起保存；任何一項改變後舊計畫不再顯示、不能寫入
+                        st.session_state.write_plan = (
+                            (target_sheet, st.session_state.extracted_hash, id_prefix, write_mode),
+                            plan_write(store.read(), new_questions, write_mode),
+                        )
+                    except ValueError as e:
+                        st.session_state.write_plan = None
+                        st.error(f"❌ {str(e)}")
+                    except Exception as e:
+                        st.session_state.write_plan = None
+                        st.error(f"❌ 無法讀取題庫：{str(e)}")
+                
+                plan_key = (target_sheet, st.session_state.extracted_hash, id_prefix, write_mode)
+                if st.session_state.write_plan is not None and st.session_state.write_plan[0] == plan_key:
+                    plan = st.session_state.write_plan[1]
+                    col_new, col_update, col_same = st.columns(3)
+                    for col, (label, count) in zip([col_new, col_update, col_same], plan.summary().items()):
+                        with col:
+                            st.metric(label, count)
+                    
+                    if not plan.appends.empty:
+                        with st.expander(f"新增 {len(plan.appends)} 題"):
+                            st.dataframe(plan.appends.head(100), use_container_width=True)
+                    if not plan.updates.empty:
+                        with st.expander(f"更新 {len(plan.updates)} 題"):
+                            st.dataframe(plan.updates.drop(columns='_row').head(100), use_container_width=True)
+                    
+                    if plan.empty:
+                        st.info("題庫已是最新，不需要寫入。")
+                    elif st.button("📤 確認寫入", use_container_width=True):
+                        run_profiler.tag('write_apply')
+                        write_progress = st.progress(0)
+                        try:
+                            store = open_store(parse_sheet_ids(target_sheet)[0])
+                            written = apply_plan(store, plan, progress=lambda done, total: write_progress.progress(done / total))
+                            st.success(f"✅ 已寫入：新增 {written['新增']} 題，更新 {written['更新']} 題")
+                            st.session_state.write_plan = None
+                            # 重新載入寫入的試算表，以及本工作階段中包含它的題庫組合
+                            target_id = parse_sheet_ids(target_sheet)[0]
+                            reload_question_bank(target_sheet)
+                            for key in ('sheet_id_main', 'sheet_id_mgmt'):
+                                if target_id in parse_sheet_ids(st.session_state.get(key, '')):
+                                    reload_question_bank(st.session_state[key])
+                        except Exception as e:
+                            st.error(f"❌ 寫入失敗：{str(e)}")
+                        finally:
+                            write_progress.empty()
+            
+            # 診斷資訊：各階段耗時與 token 用量
+            metrics = st.session_state.extraction_metrics
+            if metrics.spans and st.checkbox("🔍 顯示提取診斷資訊", key="show_diagnostics"):
+                st.markdown("---")
+                st.subheader("🔍 提取診斷資訊")
+                st.dataframe(pd.DataFrame(metrics.summary_rows()), use_container_width=True)
+                
+                if st.session_state.page_filter_decisions:
+                    st.write("**頁面篩選紀錄**")
+                    st.dataframe(pd.DataFrame(st.session_state.page_filter_decisions), use_container_width=True)
+                
+                col_diag1, col_diag2, col_diag3 = st.columns(3)
+                with col_diag1:
+                    st.download_button(
+                        label="📥 下載 JSON lines",
+                        data=metrics.to_jsonl().encode('utf-8'),
+                        file_name="extraction_spans.jsonl",
+                        mime="application/jsonl"
+                    )
+                with col_diag2:
+                    st.download_button(
+                        label="📥 下載 Prometheus 文字檔",
+                        data=metrics.to_prometheus().encode('utf-8'),
+                        file_name="extraction.prom",
+                        mime="text/plain"
+                    )
+                with col_diag3:
+                    if st.button("🗑️ 清除診斷資訊"):
+                        metrics.clear()
 
 # ==================== Tab 3: 題庫管理 ====================
 with tab3:
@@ -287,30 +689,34 @@ with tab3:
     
     # 輸入 Google Sheets ID
     sheet_id_mgmt = st.text_input(
-        "請輸入 Google Sheets ID",
-        placeholder="例如：1a2b3c4d5e6f7g8h9i0j",
+        "請輸入 Google Sheets ID（多個試算表以逗號分隔）",
+        placeholder="例如：1a2b3c4d5e6f7g8h9i0j, 9z8y7x6w5v4u3t2s1r0q",
         key="sheet_id_mgmt"
     )
     
     if sheet_id_mgmt:
-        if st.button("📖 載入題庫", use_container_width=True):
-            st.cache_data.clear()
+        if st.button("📖 載入題庫", use_container_width=True, key="load_mgmt"):
+            run_profiler.tag('load_bank')
+            reload_question_bank(sheet_id_mgmt)
         
-        df_mgmt = load_google_sheets(sheet_id_mgmt)
+        bank_mgmt = load_google_sheets(sheet_id_mgmt)
         
-        if df_mgmt is not None and not df_mgmt.empty:
-            st.success(f"✅ 成功載入 {len(df_mgmt)} 題")
+        if bank_mgmt is not None and len(bank_mgmt) > 0:
+            run_profiler.tag(bank_size=len(bank_mgmt))
+            st.success(f"✅ 成功載入 {len(bank_mgmt)} 題")
+            for warning in bank_mgmt.warnings:
+                st.warning(f"⚠️ {warning}")
             
             # 顯示統計
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("總題數", len(df_mgmt))
+                st.metric("總題數", len(bank_mgmt))
             with col2:
-                st.metric("科目數", df_mgmt['科目'].nunique())
+                st.metric("科目數", len(bank_mgmt.subjects))
             with col3:
-                st.metric("題型數", df_mgmt['類型'].nunique())
+                st.metric("題型數", len(bank_mgmt.types))
             with col4:
-                st.metric("總分數", int(df_mgmt['分數'].sum()))
+                st.metric("總分數", format_score(bank_mgmt.total_score))
             
             st.markdown("---")
             
@@ -322,19 +728,55 @@ with tab3:
             
             with col_chart1:
                 st.write("**科目分佈**")
-                subject_counts = df_mgmt['科目'].value_counts()
+                subject_counts = bank_mgmt.subject_counts()
                 st.bar_chart(subject_counts)
             
             with col_chart2:
                 st.write("**題型分佈**")
-                type_counts = df_mgmt['類型'].value_counts()
+                type_counts = bank_mgmt.type_counts()
                 st.bar_chart(type_counts)
             
             st.markdown("---")
             
-            # 顯示完整題庫表格
+            # 顯示題庫表格（伺服器端篩選與分頁，只傳送目前頁）
             st.subheader("📋 完整題庫")
-            st.dataframe(df_mgmt, use_container_width=True)
+            
+            col_filter_subject, col_filter_type, col_filter_keyword = st.columns(3)
+            with col_filter_subject:
+                mgmt_subjects = st.multiselect("篩選科目", bank_mgmt.subjects, key="mgmt_subjects")
+            with col_filter_type:
+                mgmt_types = st.multiselect("篩選題型", bank_mgmt.types, key="mgmt_types")
+            with col_filter_keyword:
+                mgmt_keyword = st.text_input("🔎 搜尋題目或 ID", key="mgmt_keyword")
+            
+            view_indices = bank_mgmt.select(mgmt_subjects or None, mgmt_types or None, mgmt_keyword)
+            
+            start, end = paginate(len(view_indices), key="bank_table", default_size=50)
+            st.dataframe(bank_mgmt.take(view_indices[start:end]), use_container_width=True)
+            
+            # 相似題目查詢（需要 scipy）
+            if SIMILARITY_AVAILABLE:
+                st.markdown("---")
+                
+                st.subheader("🔍 相似題目")
+                similar_query = st.text_input("輸入題目 ID 或一段題目文字", key="similar_query")
+                
+                if similar_query:
+                    run_profiler.tag('similar_search')
+                    query_index = bank_mgmt.find_id(similar_query.strip())
+                    query_text = bank_mgmt.texts[query_index] if query_index is not None else similar_query
+                    
+                    with st.spinner("🔍 建立相似度索引中..." if not bank_mgmt.similarity_ready else "🔍 查詢中..."):
+                        similar_indices, similar_scores = bank_mgmt.similarity.most_similar(
+                            query_text, k=10, exclude=query_index
+                        )
+                    
+                    if len(similar_indices):
+                        similar_df = bank_mgmt.take(similar_indices)
+                        similar_df.insert(0, '相似度', similar_scores.round(3))
+                        st.dataframe(similar_df, use_container_width=True)
+                    else:
+                        st.info("找不到相似的題目")
 
 # ==================== 頁尾 ====================
 st.markdown("---")
@@ -343,3 +785,5 @@ st.markdown("""
     自動化雲端出卷系統 v1.0 | 基於 Streamlit + Google Sheets
 </div>
 """, unsafe_allow_html=True)
+
+run_profiler.finish(_profiled_run)
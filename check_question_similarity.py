@@ -0,0 +1,68 @@
+"""
+相似度索引的檢查
+以合成題庫比對 SimilarityIndex 與直接以稠密矩陣計算的 TF-IDF 餘弦相似度：
+- 題庫內任兩題的分數與精確值相同
+- 出卷時以相似度上限排除的題目，與以精確值判斷的結果相同
+
+用法：
+    python check_question_similarity.py
+"""
+
+import sys
+
+import numpy as np
+
+from question_similarity import SimilarityIndex, _ngram_counts
+
+PHRASES = [
+    '甲以其所有之房屋設定抵押權予乙', '嗣後甲將該房屋出賣並移轉登記予丙', '試問乙之抵押權是否受影響',
+    '某甲涉嫌竊盜', '警察未持搜索票進入住宅搜索', '所扣押之證據有無證據能力', '行政處分之撤銷與廢止有何不同',
+    '股東會決議違反章程', '董事未盡善良管理人之注意義務', '請說明其法律效果', '並附理由說明之',
+]
+
+
+def make_texts(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return ['，'.join(rng.choice(PHRASES, rng.integers(2, 6))) + f'？（第{i}題）' for i in range(n)]
+
+
+def exact_cosines(texts) -> np.ndarray:
+    """不略去任何 n-gram 的 TF-IDF 餘弦相似度矩陣"""
+    counts = _ngram_counts(texts)
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log((1 + len(texts)) / (1 + df)) + 1
+    used = np.unique(counts.indices)
+    dense = counts[:, used].toarray().astype(np.float64)
+    dense = np.log1p(dense) * idf[used]
+    dense /= np.maximum(np.linalg.norm(dense, axis=1, keepdims=True), 1e-12)
+    return dense @ dense.T
+
+
+def check(condition: bool, message: str):
+    print(f"{'✅' if condition else '❌'} {message}")
+    if not condition:
+        check.failed = True
+
+
+check.failed = False
+
+
+def main() -> int:
+    for n in (4, 300):
+        texts = make_texts(n, seed=n)
+        index = SimilarityIndex(texts)
+        exact = exact_cosines(texts)
+        scores = np.vstack([index.similarities_to_text(t) for t in texts])
+        off_diagonal = ~np.eye(n, dtype=bool)
+        error = np.abs(scores - exact)[off_diagonal].max()
+        check(error < 1e-4, f"{n} 題：題庫內兩題的分數與精確餘弦相似度相同（最大誤差 {error:.2e}）")
+
+        cap = 0.5
+        same = np.array_equal(scores[off_diagonal] > cap, exact[off_diagonal] > cap)
+        check(same, f"{n} 題：相似度上限 {cap} 排除的題目與精確值一致")
+
+    return 1 if check.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+寫回題庫的檢查
+啟動本機模擬的 Google Sheets API，驗證 plan_write / apply_plan：
+- 多個檔案的提取結果（各自從第 1 題起算）不會因 ID 相同而互相覆蓋
+- 新題目中有重複 ID 時拒絕產生計畫
+- 更新只寫入必要欄位，老師自行加的欄位（備註）保持不變
+- 新增批次寫入成功但回應失敗（503）時，重試不會產生重複題目
+
+用法：
+    python check_question_writer.py
+"""
+
+import http.server
+import json
+import socketserver
+import sys
+import tempfile
+import threading
+
+import pandas as pd
+
+import question_writer as qw
+
+HEADER = ['ID', '類型', '科目', '題目內容', '參考解答', '分數', '備註']
+
+
+class MockSheets:
+    """只實作 values GET / append / batchUpdate 的模擬試算表"""
+
+    def __init__(self, values):
+        self.values = [list(row) for row in values]
+        self.fail_appends = 0  # 接下來幾次新增在寫入後回傳 503
+
+        mock = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def _send(self, obj, code=200):
+                body = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._send({'values': mock.values})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if ':append' in self.path:
+                    mock.values += body['values']
+                    if mock.fail_appends:
+                        mock.fail_appends -= 1
+                        return self._send({'error': 'unavailable'}, 503)
+                else:
+                    for entry in body['data']:
+                        start, end = entry['range'].split(':')
+                        mock.write_range(start, end, entry['values'][0])
+                self._send({})
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def write_range(self, start: str, end: str, values):
+        """A1 形式的單列範圍，例如 B3:F3"""
+        row = int(''.join(c for c in start if c.isdigit()))
+        first = _column_index(''.join(c for c in start if c.isalpha()))
+        last = _column_index(''.join(c for c in end if c.isalpha()))
+        target = self.values[row - 1]
+        target += [''] * (last + 1 - len(target))
+        target[first:last + 1] = values
+
+    def frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.values[1:], columns=self.values[0])
+
+
+def _column_index(letters: str) -> int:
+    n = 0
+    for c in letters:
+        n = n * 26 + ord(c) - 64
+    return n - 1
+
+
+def question(qid, text, subject='民法', score=25):
+    return {'ID': qid, '類型': '申論題', '科目': subject, '題目內容': text, '參考解答': '待補充', '分數': score}
+
+
+def check(condition: bool, message: str):
+    print(f"{'✅' if condition else '❌'} {message}")
+    if not condition:
+        check.failed = True
+
+
+check.failed = False
+
+
+def main() -> int:
+    qw.RETRY_BACKOFF = 0.01
+    mock = MockSheets([HEADER, ['Q1', '申論題', '民法', '舊題目', '解', '25', '老師的備註']])
+    store = qw.SheetsAPIStore('sheet', token='token', base_url=mock.url)
+
+    # 多個檔案：舊的提取器每個檔案都從 001 起算，ID 相同時必須拒絕，而不是只保留最後一個檔案
+    colliding = pd.DataFrame([question('001', '檔案 A 第 1 題'), question('002', '檔案 A 第 2 題'),
+                              question('001', '檔案 B 第 1 題')])
+    try:
+        qw.plan_write(store.read(), colliding)
+        check(False, "重複 ID 應拒絕產生計畫")
+    except ValueError as e:
+        check('001' in str(e), f"重複 ID 拒絕產生計畫：{e}")
+
+    # 提取器產生的 ID（檔案雜湊-頁碼-序號）：三題都應新增
+    extracted = pd.DataFrame([question('aaaa1111-p001-01', '檔案 A 第 1 題'),
+                              question('aaaa1111-p001-02', '檔案 A 第 2 題'),
+                              question('bbbb2222-p001-01', '檔案 B 第 1 題')])
+    plan = qw.plan_write(store.read(), extracted)
+    check(plan.summary() == {'新增': 3, '更新': 0, '不變': 0}, f"多檔案提取結果全部新增：{plan.summary()}")
+
+    # 新增時第一個批次寫入成功但回應 503，重試不應重複寫入
+    mock.fail_appends = 1
+    written = qw.apply_plan(store, plan)
+    ids = mock.frame()['ID'].tolist()
+    check(written['新增'] == 3 and len(ids) == len(set(ids)) == 4, f"重試後沒有重複題目：{ids}")
+
+    # 更新既有題目：只寫入必要欄位，備註保持不變
+    changed = pd.DataFrame([question('Q1', '新題目')])
+    plan = qw.plan_write(store.read(), changed)
+    check(plan.summary() == {'新增': 0, '更新': 1, '不變': 0}, f"更新既有題目：{plan.summary()}")
+    qw.apply_plan(store, plan)
+    row = mock.frame().set_index('ID').loc['Q1']
+    check(row['題目內容'] == '新題目' and row['備註'] == '老師的備註', f"更新後備註保留：{row.to_dict()}")
+
+    # 新題目沒有備註欄，不應被視為變更
+    plan = qw.plan_write(store.read(), changed)
+    check(plan.empty and plan.summary()['不變'] == 1, f"再次預覽沒有變更：{plan.summary()}")
+
+    # 只新增模式：已存在的 ID 回報為略過，新的 ID 照常新增
+    plan = qw.plan_write(store.read(), pd.DataFrame([question('Q1', '另一個版本'), question('Q9', '新題')]),
+                         qw.MODE_APPEND)
+    check(plan.summary() == {'新增': 1, '更新': 0, '已存在（略過）': 1}, f"只新增模式：{plan.summary()}")
+
+    # 本機 CSV 寫入目標：同樣只更新必要欄位
+    store_csv = qw.open_store('sheet', tempfile.mkdtemp())
+    store_csv._write(pd.DataFrame([['Q1', '申論題', '民法', '舊題目', '解', '25', '備註']], columns=HEADER))
+    qw.apply_plan(store_csv, qw.plan_write(store_csv.read(), changed))
+    row = store_csv.read().set_index('ID').loc['Q1']
+    check(row['題目內容'] == '新題目' and row['備註'] == '備註', f"CSV 更新後備註保留：{row.to_dict()}")
+
+    return 1 if check.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
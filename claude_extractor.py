@@ -7,8 +7,7 @@ import anthropic
 import json
 import re
 from typing import List, Dict
-import PyPDF2
-import io
+from pdf_document import PdfDocument
 
 class ClaudeTextExtractor:
     """使用 Claude 從 PDF 文字提取法律題目"""
@@ -18,21 +17,21 @@ class ClaudeTextExtractor:
         self.client = anthropic.Anthropic(api_key=api_key)
         self.model = "claude-3-5-sonnet-20241022"
     
-    def extract_text_from_pdf(self, pdf_bytes: bytes) -> str:
-        """從 PDF 提取所有文字"""
+    def extract_text_from_pdf(self, pdf) -> str:
+        """從 PDF（PdfDocument、位元組或路徑）提取所有文字；頁數多時並行提取"""
+        document = PdfDocument.open(pdf)
         try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
-            text = ""
-            
-            for page_num, page in enumerate(pdf_reader.pages, 1):
-                page_text = page.extract_text()
-                if page_text:
-                    text += f"\n--- 第 {page_num} 頁 ---\n{page_text}"
-            
-            return text
+            return "".join(
+                f"\n--- 第 {page_num} 頁 ---\n{page_text}"
+                for page_num, page_text in enumerate(document.texts(), 1)
+                if page_text
+            )
         except Exception as e:
             print(f"PDF 文字提取失敗：{e}")
             return ""
+        finally:
+            if document is not pdf:
+                document.close()
     
     def extract_with_claude(self, text: str) -> List[Dict]:
         """使用 Claude 分析文字並提取題目"""
@@ -96,10 +95,10 @@ class ClaudeTextExtractor:
             print(f"Claude 提取失敗：{e}")
             return []
     
-    def extract_from_pdf(self, pdf_bytes: bytes, filename: str = "") -> List[Dict]:
+    def extract_from_pdf(self, pdf, filename: str = "") -> List[Dict]:
         """從 PDF 提取所有題目"""
         # 步驟 1：提取文字
-        text = self.extract_text_from_pdf(pdf_bytes)
+        text = self.extract_text_from_pdf(pdf)
         
         if not text or len(text.strip()) < 100:
             print("❌ 無法從 PDF 提取足夠的文字")
@@ -0,0 +1,228 @@
+"""
+考卷匯出模組
+將考卷渲染為 CSV / DOCX / PDF（試題卷與解答卷），依內容雜湊快取，並可在背景批次產生多版本 ZIP
+"""
+
+import hashlib
+import importlib.util
+import io
+import random
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from question_bank import format_score
+
+# 檢查 DOCX / PDF 產生庫是否已安裝（只查找不導入，實際匯出時才載入，避免拖慢 app 啟動）
+DOCX_AVAILABLE = importlib.util.find_spec('docx') is not None
+PDF_EXPORT_AVAILABLE = importlib.util.find_spec('reportlab') is not None
+
+EXPORT_COLUMNS = ['ID', '類型', '科目', '題目內容', '參考解答', '分數']
+
+# 匯出格式：(副檔名, MIME 類型)
+FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'docx_paper': ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    'docx_answers': ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+    'pdf_paper': ('pdf', 'application/pdf'),
+    'pdf_answers': ('pdf', 'application/pdf'),
+}
+
+# reportlab 內建的繁體中文 CID 字型，不需額外字型檔
+PDF_FONT = 'MSung-Light'
+
+
+def available_formats() -> List[str]:
+    """回傳目前環境可產生的匯出格式"""
+    formats = ['csv']
+    if DOCX_AVAILABLE:
+        formats += ['docx_paper', 'docx_answers']
+    if PDF_EXPORT_AVAILABLE:
+        formats += ['pdf_paper', 'pdf_answers']
+    return formats
+
+
+def exam_content_hash(df: pd.DataFrame) -> str:
+    """計算考卷內容雜湊，內容相同的考卷共用同一份匯出結果"""
+    columns = [c for c in EXPORT_COLUMNS if c in df.columns]
+    payload = df[columns].to_csv(index=False).encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+# ==================== 渲染函數 ====================
+def render_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode('utf-8-sig')
+
+
+def render_docx(df: pd.DataFrame, with_answers: bool, title: str = "考卷") -> bytes:
+    """產生 Word 試題卷（with_answers=True 時為解答卷）"""
+    if not DOCX_AVAILABLE:
+        raise RuntimeError("python-docx 未安裝，無法匯出 DOCX")
+    import docx
+
+    document = docx.Document()
+    document.add_heading(f"{title}{'（解答）' if with_answers else ''}", level=1)
+    document.add_paragraph(f"共 {len(df)} 題，總分 {format_score(df['分數'].sum())} 分")
+
+    for i, (_, row) in enumerate(df.iterrows(), 1):
+        document.add_heading(f"第 {i} 題（{row['科目']}｜{row['類型']}｜{row['分數']} 分）", level=2)
+        document.add_paragraph(str(row['題目內容']))
+        if with_answers:
+            document.add_paragraph(f"參考解答：{row['參考解答']}")
+
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def render_pdf(df: pd.DataFrame, with_answers: bool, title: str = "考卷") -> bytes:
+    """產生 PDF 試題卷（with_answers=True 時為解答卷）"""
+    if not PDF_EXPORT_AVAILABLE:
+        raise RuntimeError("reportlab 未安裝，無法匯出 PDF")
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+    if PDF_FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(UnicodeCIDFont(PDF_FONT))
+
+    heading = ParagraphStyle('heading', fontName=PDF_FONT, fontSize=16, leading=22, spaceAfter=8)
+    subheading = ParagraphStyle('subheading', fontName=PDF_FONT, fontSize=12, leading=18, spaceBefore=8)
+    body = ParagraphStyle('body', fontName=PDF_FONT, fontSize=11, leading=17, wordWrap='CJK')
+
+    story = [
+        Paragraph(f"{title}{'（解答）' if with_answers else ''}", heading),
+        Paragraph(f"共 {len(df)} 題，總分 {format_score(df['分數'].sum())} 分", body),
+        Spacer(1, 8),
+    ]
+    for i, (_, row) in enumerate(df.iterrows(), 1):
+        story.append(Paragraph(f"第 {i} 題（{row['科目']}｜{row['類型']}｜{row['分數']} 分）", subheading))
+        story.append(Paragraph(_pdf_text(row['題目內容']), body))
+        if with_answers:
+            story.append(Paragraph(f"參考解答：{_pdf_text(row['參考解答'])}", body))
+
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=A4, title=title).build(story)
+    return buffer.getvalue()
+
+
+def _pdf_text(value) -> str:
+    """轉義 reportlab Paragraph 的標記字元並保留換行"""
+    text = str(value).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return text.replace('\n', '<br/>')
+
+
+def render(df: pd.DataFrame, fmt: str, title: str = "考卷") -> bytes:
+    """依格式名稱渲染考卷"""
+    if fmt == 'csv':
+        return render_csv(df)
+    if fmt in ('docx_paper', 'docx_answers'):
+        return render_docx(df, fmt == 'docx_answers', title)
+    if fmt in ('pdf_paper', 'pdf_answers'):
+        return render_pdf(df, fmt == 'pdf_answers', title)
+    raise ValueError(f"不支援的匯出格式：{fmt}")
+
+
+# ==================== 快取 ====================
+class ArtifactCache:
+    """以 (內容雜湊, 格式) 為鍵的匯出結果快取，超過上限時淘汰最久未使用的項目"""
+
+    def __init__(self, max_items: int = 64):
+        self.max_items = max_items
+        self._items: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, df: pd.DataFrame, fmt: str, content_hash: Optional[str] = None) -> bytes:
+        key = (content_hash or exam_content_hash(df), fmt)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        data = render(df, fmt)
+
+        with self._lock:
+            self._items[key] = data
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return data
+
+
+artifact_cache = ArtifactCache()
+
+
+# ==================== 多版本背景打包 ====================
+def make_variant(df: pd.DataFrame, seed: int) -> pd.DataFrame:
+    """以固定種子打亂題目順序產生一個版本，同一種子永遠得到相同版本"""
+    order = list(range(len(df)))
+    random.Random(seed).shuffle(order)
+    return df.iloc[order].reset_index(drop=True)
+
+
+class BundleJob:
+    """背景產生多版本考卷 ZIP 的工作"""
+
+    def __init__(self, df: pd.DataFrame, variants: int, formats: List[str]):
+        self.df = df
+        self.variants = variants
+        self.formats = formats
+        self.done_steps = 0
+        self.total_steps = variants * len(formats)
+        self.result: Optional[bytes] = None
+        self.error: Optional[str] = None
+        self.future = None
+
+    @property
+    def progress(self) -> float:
+        if self.total_steps == 0:
+            return 1.0
+        return self.done_steps / self.total_steps
+
+    @property
+    def finished(self) -> bool:
+        return self.result is not None or self.error is not None
+
+    def run(self):
+        try:
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for v in range(1, self.variants + 1):
+                    variant_df = make_variant(self.df, seed=v)
+                    for fmt in self.formats:
+                        ext = FORMATS[fmt][0]
+                        zf.writestr(f"版本{v:03d}/{fmt}.{ext}", render(variant_df, fmt, title=f"考卷 版本 {v}"))
+                        self.done_steps += 1
+            self.result = buffer.getvalue()
+        except Exception as e:
+            self.error = str(e)
+
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="exam-export")
+_jobs: "OrderedDict[Tuple[str, int, Tuple[str, ...]], BundleJob]" = OrderedDict()
+_jobs_lock = threading.Lock()
+MAX_JOBS = 16
+
+
+def submit_bundle(df: pd.DataFrame, variants: int, formats: List[str],
+                  content_hash: Optional[str] = None) -> BundleJob:
+    """
+    提交多版本打包工作；相同內容、版本數與格式的請求共用同一個工作，
+    已完成的結果會直接重用
+    """
+    key = (content_hash or exam_content_hash(df), variants, tuple(formats))
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is None or job.error is not None:
+            job = BundleJob(df, variants, list(formats))
+            _jobs[key] = job
+            job.future = _executor.submit(job.run)
+            # 只保留最近的工作結果，避免 ZIP 佔用過多記憶體
+            for old_key in [k for k, j in _jobs.items() if j.finished][:max(0, len(_jobs) - MAX_JOBS)]:
+                del _jobs[old_key]
+    return job
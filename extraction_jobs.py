@@ -0,0 +1,212 @@
+"""
+PDF 提取的預算與背景工作
+每份文件與每個批次可設定時間、頁數與 token 上限；超出預算或使用者按下停止時，
+處理完目前頁面後即停止，已提取的題目照常回傳，並記錄哪些頁面未處理
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import run_profiler
+
+
+class ExtractionBudget:
+    """
+    提取預算；None 表示不限
+    時間上限從 start() 起算（批次預算在背景工作開始執行時才開始計時，排隊的時間不算）；
+    以 child() 建立的單一文件預算建立時即開始計時，同時受批次預算限制，取消時整個批次一起停止
+    """
+
+    def __init__(self, deadline_seconds: Optional[float] = None, max_pages: Optional[int] = None,
+                 max_tokens: Optional[int] = None, parent: Optional["ExtractionBudget"] = None):
+        self.deadline_seconds = deadline_seconds or None
+        self.deadline = None
+        self.max_pages = max_pages or None
+        self.max_tokens = max_tokens or None
+        self.parent = parent
+        self.pages = 0
+        self.tokens = 0
+        self.skipped: List[Dict] = parent.skipped if parent is not None else []
+        self._cancelled = parent._cancelled if parent is not None else threading.Event()
+        self._lock = threading.Lock()
+
+    def child(self, deadline_seconds: Optional[float] = None, max_pages: Optional[int] = None,
+              max_tokens: Optional[int] = None) -> "ExtractionBudget":
+        child = ExtractionBudget(deadline_seconds, max_pages, max_tokens, parent=self)
+        child.start()
+        return child
+
+    def start(self):
+        """開始計時；重複呼叫不會重設"""
+        if self.deadline_seconds and self.deadline is None:
+            self.deadline = time.monotonic() + self.deadline_seconds
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def charge(self, pages: int = 0, tokens: int = 0):
+        """記錄已使用的頁數與 token（同時計入批次預算）"""
+        with self._lock:
+            self.pages += pages
+            self.tokens += tokens
+        if self.parent is not None:
+            self.parent.charge(pages, tokens)
+
+    def exhausted(self) -> Optional[str]:
+        """預算用完時回傳原因，否則回傳 None"""
+        if self.cancelled:
+            return "使用者已停止"
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return "超過時間上限"
+        if self.max_pages is not None and self.pages >= self.max_pages:
+            return f"已達頁數上限 {self.max_pages} 頁"
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return f"已達 token 上限 {self.max_tokens}"
+        if self.parent is not None:
+            reason = self.parent.exhausted()
+            return f"批次{reason}" if reason else None
+        return None
+
+    def remaining_pages(self) -> Optional[int]:
+        """還可處理的頁數（同時受批次預算限制）；None 表示不限"""
+        remaining = None if self.max_pages is None else max(0, self.max_pages - self.pages)
+        if self.parent is not None:
+            parent = self.parent.remaining_pages()
+            if parent is not None:
+                remaining = parent if remaining is None else min(remaining, parent)
+        return remaining
+
+    def note_skipped(self, filename: str, pages: Optional[List[int]], reason: str):
+        """記錄未處理的頁面；pages 為 None 表示整份文件未處理"""
+        self.skipped.append({'file': filename, 'pages': pages, 'reason': reason})
+
+    def skipped_notes(self) -> List[str]:
+        """每個檔案、每種原因一行；逐頁記錄的失敗頁面合併為頁碼範圍"""
+        notes = []
+        pages_by_reason: Dict[Tuple[str, str], List[int]] = {}
+        for entry in self.skipped:
+            if entry['pages'] is None:
+                notes.append(f"{entry['file']}：整份未處理（{entry['reason']}）")
+            elif entry['pages']:
+                key = (entry['file'], entry['reason'])
+                if key not in pages_by_reason:
+                    pages_by_reason[key] = []
+                    notes.append(key)
+                pages_by_reason[key].extend(entry['pages'])
+        return [
+            note if isinstance(note, str)
+            else f"{note[0]}：第 {_page_ranges(pages_by_reason[note])} 頁未處理（{note[1]}）"
+            for note in notes
+        ]
+
+
+def _page_ranges(pages: List[int]) -> str:
+    """[1, 2, 3, 7] → "1-3、7" """
+    ranges = []
+    for page in sorted(pages):
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return '、'.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+class ExtractionJob:
+    """背景提取一批 PDF 的工作；app 以「更新進度」查詢狀態，以 budget.cancel() 停止"""
+
+    def __init__(self, files: List[Tuple[str, Any]], extract: Callable[..., List[Dict]],
+                 budget: ExtractionBudget, document_limits: Optional[Dict] = None,
+                 profile_tags: Optional[Dict] = None):
+        self.files = files
+        self.extract = extract
+        self.budget = budget
+        self.document_limits = document_limits or {}
+        self.profile_tags = profile_tags or {}  # 效能剖析紀錄的標籤（工作階段等）
+        self.done_files = 0
+        self.total_pages = 0  # 開始執行後才計算；PDF 為位元組時無法預先得知頁數，進度改以檔案計
+        self.done_pages = 0
+        self.started = False  # False 表示仍在排隊，等待其他提取工作完成
+        self.current = ""
+        self.questions: List[Dict] = []
+        self.errors: List[str] = []
+        self.finished = False
+        self.collected = False  # app 是否已取回結果並完成後續處理
+        self.future = None
+
+    @property
+    def progress(self) -> float:
+        if self.total_pages:
+            return min(1.0, self.done_pages / self.total_pages)
+        return self.done_files / len(self.files) if self.files else 1.0
+
+    def run(self):
+        self.started = True
+        self.budget.start()
+        with run_profiler.profiled('extraction', **self.profile_tags) as profiled_run:
+            self._run()
+            if profiled_run is not None:
+                profiled_run.tag('extract', pages=self.budget.pages, tokens=self.budget.tokens,
+                                 questions=len(self.questions))
+
+    def _run(self):
+        try:
+            page_counts = [_page_count(pdf) for _, pdf in self.files]
+            if all(page_counts):
+                self.total_pages = sum(page_counts)
+            
+            for (filename, pdf), page_count in zip(self.files, page_counts):
+                self.current = filename
+                pages_before = self.done_pages
+                
+                def on_page(page_num, pages_before=pages_before):
+                    self.done_pages = pages_before + page_num
+                
+                reason = self.budget.exhausted()
+                if reason:
+                    self.budget.note_skipped(filename, None, reason)
+                else:
+                    try:
+                        questions = self.extract(pdf, filename, budget=self.budget.child(**self.document_limits),
+                                                 on_page=on_page)
+                        self.questions.extend(questions or [])
+                    except Exception as e:
+                        self.errors.append(f"{filename}：{e}")
+                self.done_files += 1
+                # 未處理（預算用完、讀取失敗）的頁面也算完成，進度不會停在中途
+                self.done_pages = pages_before + page_count
+        finally:
+            self.current = ""
+            self.finished = True
+            # 上傳時暫存的文件處理完即刪除
+            for _, pdf in self.files:
+                if hasattr(pdf, 'close'):
+                    pdf.close()
+
+
+def _page_count(pdf) -> int:
+    """暫存的 PdfDocument 可預先得知頁數；位元組或讀取失敗時回傳 0"""
+    try:
+        return pdf.page_count if hasattr(pdf, 'page_count') else 0
+    except Exception:
+        return 0
+
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pdf-extract")
+
+
+def submit_extraction(files: List[Tuple[str, Any]], extract: Callable[..., List[Dict]],
+                      budget: ExtractionBudget, document_limits: Optional[Dict] = None,
+                      profile_tags: Optional[Dict] = None) -> ExtractionJob:
+    """
+    在背景執行提取；files 為 (檔名, PDF) 列表，PDF 可為位元組或 PdfDocument（完成後自動關閉），
+    extract 需接受 (pdf, filename, budget=..., on_page=...)，每處理完一頁以頁碼呼叫 on_page
+    """
+    job = ExtractionJob(files, extract, budget, document_limits, profile_tags)
+    job.future = _executor.submit(job.run)
+    return job
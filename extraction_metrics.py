@@ -0,0 +1,279 @@
+"""
+PDF 提取流程的效能量測
+記錄每頁各階段耗時、傳送位元組數與 token 用量，並匯出為 JSON lines / Prometheus 格式
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Optional
+
+# 提取流程的階段名稱
+STAGES = ['convert', 'prefilter', 'phash', 'jpeg_encode', 'base64', 'model_call', 'json_parse']
+
+# 每百萬 token 的費用（美元），用於估算成本
+TOKEN_PRICES = {
+    'gemini-2.0-flash': {'input': 0.10, 'output': 0.40, 'cached_input': 0.025},
+    'claude-3-5-sonnet-20241022': {'input': 3.00, 'output': 15.00, 'cached_input': 0.30},
+}
+
+
+class Span:
+    """單一階段的量測紀錄"""
+
+    def __init__(self, stage: str, filename: str = "", page: Optional[int] = None):
+        self.stage = stage
+        self.filename = filename
+        self.page = page
+        self.start = time.time()
+        self.duration = 0.0
+        self.bytes_sent = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_tokens = 0   # 輸入 token 中由上下文快取提供的部分
+        self.model = ""
+
+    def to_dict(self) -> Dict:
+        return {
+            'stage': self.stage,
+            'file': self.filename,
+            'page': self.page,
+            'start': round(self.start, 6),
+            'duration': round(self.duration, 6),
+            'bytes_sent': self.bytes_sent,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cached_tokens': self.cached_tokens,
+            'model': self.model,
+        }
+
+
+class PipelineMetrics:
+    """收集整個工作階段（session）內所有檔案的量測資料"""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    @contextmanager
+    def span(self, stage: str, filename: str = "", page: Optional[int] = None):
+        """量測一個階段；呼叫端可在區塊內填入 bytes_sent、token 等欄位"""
+        record = Span(stage, filename, page)
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.duration = time.perf_counter() - started
+            self.spans.append(record)
+
+    def split(self, span: Span, pages: List[int], weights: List[float], output_weights: Optional[List[float]] = None):
+        """
+        把一次涵蓋多頁的請求拆成每頁一筆紀錄，每頁的 token 用量仍可個別統計：
+        耗時、位元組與輸入 token 依 weights 分攤，輸出 token 依 output_weights（預設同 weights）分攤；
+        原紀錄成為第一頁的紀錄
+        """
+        if len(pages) <= 1:
+            return
+        output_weights = output_weights or weights
+        shares = {
+            'bytes_sent': _apportion(span.bytes_sent, weights),
+            'input_tokens': _apportion(span.input_tokens, weights),
+            'cached_tokens': _apportion(span.cached_tokens, weights),
+            'output_tokens': _apportion(span.output_tokens, output_weights),
+        }
+        total_weight = sum(weights) or 1
+        duration = span.duration
+        for i, page in enumerate(pages):
+            record = span if i == 0 else Span(span.stage, span.filename, page)
+            record.start = span.start
+            record.model = span.model
+            record.duration = duration * weights[i] / total_weight
+            for field, values in shares.items():
+                setattr(record, field, values[i])
+            if i > 0:
+                self.spans.append(record)
+
+    def clear(self):
+        self.spans = []
+
+    def files(self) -> List[str]:
+        seen = []
+        for s in self.spans:
+            if s.filename not in seen:
+                seen.append(s.filename)
+        return seen
+
+    def summarize(self, filename: Optional[str] = None) -> Dict:
+        """彙總指定檔案（或整個工作階段）的各階段耗時與 token 用量"""
+        summary = summarize_spans([s for s in self.spans if filename is None or s.filename == filename])
+        summary['file'] = filename if filename is not None else '*'
+        return summary
+
+    def summary_rows(self) -> List[Dict]:
+        """每個檔案一列，最後一列為整個工作階段的合計，供表格顯示"""
+        rows = []
+        for summary in [self.summarize(f) for f in self.files()] + [self.summarize()]:
+            row = {
+                '檔案': summary['file'],
+                '頁數': summary['pages'],
+                '略過頁數': summary['skipped_pages'],
+                '篩除頁數': summary['filtered_pages'],
+                '總秒數': round(summary['seconds'], 3),
+                '傳送位元組': summary['bytes_sent'],
+                '輸入 token': summary['input_tokens'],
+                '輸出 token': summary['output_tokens'],
+                '快取 token': summary['cached_tokens'],
+                '估計成本 (USD)': round(summary['cost_usd'], 6),
+            }
+            for stage in STAGES:
+                row[f'{stage} 秒'] = round(summary['stages'].get(stage, {}).get('seconds', 0.0), 3)
+            rows.append(row)
+        return rows
+
+    def to_jsonl(self, since: int = 0) -> str:
+        """匯出為 JSON lines，每個 span 一行；since 可只匯出第 since 筆之後的紀錄"""
+        return "".join(json.dumps(s.to_dict(), ensure_ascii=False) + "\n" for s in self.spans[since:])
+
+    def to_prometheus(self) -> str:
+        """本工作階段的量測快照（Prometheus 格式，供下載）；持續累計的計數器見 MetricsRegistry"""
+        return _render_prometheus(summarize_spans(self.spans))
+
+    def write_jsonl(self, path: str, since: int = 0):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(self.to_jsonl(since))
+
+
+
+def summarize_spans(spans: List[Span]) -> Dict:
+    stages = {}
+    for s in spans:
+        agg = stages.setdefault(s.stage, {'count': 0, 'seconds': 0.0, 'bytes_sent': 0})
+        agg['count'] += 1
+        agg['seconds'] += s.duration
+        agg['bytes_sent'] += s.bytes_sent
+
+    return {
+        'pages': len({(s.filename, s.page) for s in spans if s.page is not None}),
+        'seconds': sum(s.duration for s in spans),
+        'bytes_sent': sum(s.bytes_sent for s in spans),
+        'input_tokens': sum(s.input_tokens for s in spans),
+        'output_tokens': sum(s.output_tokens for s in spans),
+        'cached_tokens': sum(s.cached_tokens for s in spans),
+        'cost_usd': sum(estimate_cost(s.model, s.input_tokens, s.output_tokens, s.cached_tokens) for s in spans),
+        'skipped_pages': sum(1 for s in spans if s.stage == 'dedup_skip'),
+        'filtered_pages': sum(1 for s in spans if s.stage == 'prefilter_skip'),
+        'stages': stages,
+    }
+
+
+# Prometheus 計數器：(名稱, 說明, summarize_spans 的欄位)
+COUNTERS = [
+    ('exam_extract_bytes_sent_total', 'Bytes sent to the model.', 'bytes_sent'),
+    ('exam_extract_input_tokens_total', 'Model input tokens.', 'input_tokens'),
+    ('exam_extract_output_tokens_total', 'Model output tokens.', 'output_tokens'),
+    ('exam_extract_cached_tokens_total', 'Input tokens served from the context cache.', 'cached_tokens'),
+    ('exam_extract_pages_total', 'Pages processed.', 'pages'),
+    ('exam_extract_skipped_pages_total', 'Duplicate pages skipped before the model call.', 'skipped_pages'),
+    ('exam_extract_filtered_pages_total', 'Pages the local pre-filter kept from the model.', 'filtered_pages'),
+    ('exam_extract_cost_usd_total', 'Estimated model cost in USD.', 'cost_usd'),
+]
+
+
+def _render_prometheus(summary: Dict) -> str:
+    """Prometheus text exposition 格式；只以階段為標籤，不以檔名為標籤以免序列數無限增加"""
+    lines = [
+        '# HELP exam_extract_stage_seconds_total Time spent per extraction stage.',
+        '# TYPE exam_extract_stage_seconds_total counter',
+    ]
+    for stage, agg in sorted(summary['stages'].items()):
+        lines.append(f'exam_extract_stage_seconds_total{{stage="{_escape(stage)}"}} {agg["seconds"]:.6f}')
+
+    for name, help_text, key in COUNTERS:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name} {summary[key]}')
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRegistry:
+    """
+    程序層級的累計計數器；所有工作階段的批次結束時都累加到這裡，
+    計數器只增不減（清除工作階段的診斷資訊不影響），供 node_exporter textfile collector 讀取
+    """
+
+    def __init__(self):
+        self.totals = {key: 0 for _, _, key in COUNTERS}
+        self.stage_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, spans: List[Span]):
+        summary = summarize_spans(spans)
+        with self._lock:
+            for key in self.totals:
+                self.totals[key] += summary[key]
+            for stage, agg in summary['stages'].items():
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + agg['seconds']
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            summary = dict(self.totals, stages={k: {'seconds': v} for k, v in self.stage_seconds.items()})
+        return _render_prometheus(summary)
+
+    def write_prometheus(self, path: str):
+        """先寫入同目錄的暫存檔再取代，collector 不會讀到寫一半的檔案"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+# 程序內所有工作階段共用
+PROCESS_METRICS = MetricsRegistry()
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> float:
+    """根據 TOKEN_PRICES 估算單次呼叫的費用；快取提供的輸入 token 以快取價格計算"""
+    prices = TOKEN_PRICES.get(model)
+    if not prices:
+        return 0.0
+    cached_tokens = min(cached_tokens, input_tokens)
+    return (
+        (input_tokens - cached_tokens) * prices['input']
+        + cached_tokens * prices.get('cached_input', prices['input'])
+        + output_tokens * prices['output']
+    ) / 1_000_000
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _apportion(total: int, weights: List[float]) -> List[int]:
+    """依權重把整數分攤到各份，總和不變（最大餘數法）"""
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        weights, weight_sum = [1] * len(weights), len(weights)
+    exact = [total * w / weight_sum for w in weights]
+    shares = [int(x) for x in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - shares[i], reverse=True)
+    for i in by_remainder[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+@contextmanager
+def maybe_span(metrics: Optional[PipelineMetrics], stage: str, filename: str = "", page: Optional[int] = None):
+    """metrics 為 None 時不做任何量測，讓提取器在未啟用量測時不需分支"""
+    if metrics is None:
+        yield Span(stage, filename, page)
+    else:
+        with metrics.span(stage, filename, page) as record:
+            yield record
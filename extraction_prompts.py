@@ -0,0 +1,49 @@
+"""
+AI 提取的共用提示詞
+完整指示作為系統指示（可由供應商快取），每次請求只送出簡短的頁面提示；
+一次請求可包含多頁，指示的 token 由多頁攤提
+"""
+
+from typing import List
+
+# 提取指示：所有頁面共用，作為系統指示只需送出 / 快取一次
+EXTRACTION_INSTRUCTION = """你是一位法律教授。請仔細分析使用者提供的試題頁面圖片中的所有法律題目。
+
+請以 JSON 格式返回提取的所有題目，格式如下：
+{
+    "questions": [
+        {
+            "question_text": "完整的題目內容（一字不漏）",
+            "answer_text": "完整的解答內容（如果有的話，一字不漏）",
+            "subject": "科目（民法/刑法/民訴/刑訴/行政法/商法/智財法/勞動法/環保法/稅法）",
+            "type": "題型（申論題/案例題/選擇題）",
+            "difficulty": "難度（簡單/中等/困難）",
+            "page": 題目開始的頁碼,
+            "continued": false
+        }
+    ]
+}
+
+重要提示：
+1. 完整保留原文，一字不漏，不要竄改
+2. 如果有案例，請完整保留案例內容
+3. 如果有解答，請完整保留解答內容
+4. 自動判斷科目（根據題目內容）
+5. 自動判斷題型
+6. 只返回 JSON，不要其他文字
+7. 如果找不到題目，返回空的 questions 陣列
+8. 若提供了上一頁結尾，僅用於判斷第一頁開頭是否接續上一題；接續的部分只提取這些頁面的文字，並將該題的 continued 設為 true
+9. 一次提供多頁時，每張圖片前標有頁碼；跨越這些頁面的題目合併為一題，page 填寫題目開始的頁碼"""
+
+
+def build_page_prompt(page_num: int, previous_tail: str = "") -> str:
+    """單頁的簡短提示；previous_tail 為上一頁結尾的文字"""
+    return build_pages_prompt([page_num], previous_tail)
+
+
+def build_pages_prompt(page_nums: List[int], previous_tail: str = "") -> str:
+    """一次請求多頁的簡短提示；previous_tail 為前一頁結尾的文字"""
+    prompt = f"請提取第 {'、'.join(str(p) for p in page_nums)} 頁的題目。"
+    if previous_tail:
+        prompt += f"\n\n【上一頁結尾，僅供判斷跨頁題目，不要重複提取】\n{previous_tail}"
+    return prompt
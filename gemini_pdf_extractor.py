@@ -6,15 +6,41 @@
 import google.generativeai as genai
 import json
 import re
-from typing import List, Dict
-import PyPDF2
-from pdf2image import convert_from_bytes
+from functools import lru_cache
+from typing import Callable, List, Dict, Iterator, Optional, Tuple
 import io
 import os
+import threading
+import time
+from extraction_metrics import PipelineMetrics, maybe_span
+from page_dedup import PageDeduplicator, page_hash
+from page_filter import PageFilter
+from pdf_document import PdfDocument
+from extraction_prompts import EXTRACTION_INSTRUCTION, build_pages_prompt
+from extraction_jobs import ExtractionBudget
+
+# 開啟跨批次合併時，提供前一頁結尾的字數
+CONTEXT_TAIL_CHARS = 300
+
+# 每次請求送出的頁數：提取指示每次請求只送一次，多頁一起送可攤提指示的 token，
+# 同一請求內的跨頁題目也由模型直接合併
+PAGES_PER_REQUEST = 4
+
+# 供應商端快取的存活時間（秒）
+CACHE_TTL_SECONDS = 3600
+
+# 供應商端快取的最小 token 數（gemini-2.0-flash）；指示短於此值時不嘗試建立快取
+MIN_CACHE_TOKENS = 4096
+
+# 建立快取暫時失敗（逾時、配額等）後，隔多久再試（秒）
+CACHE_RETRY_SECONDS = 300
+
 
 class GeminiPDFExtractor:
     """使用 Google Gemini Vision API 提取法律題目"""
     
+    MODEL_NAME = 'gemini-2.0-flash'
+    
     def __init__(self, api_key: str = None):
         """初始化 Gemini 客戶端"""
         # 使用環境變數中的 API Key
@@ -25,104 +51,351 @@ class GeminiPDFExtractor:
             raise ValueError("Gemini API Key 未設定。請設定 GEMINI_API_KEY 環境變數。")
         
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+        self.model = genai.GenerativeModel(self.MODEL_NAME, system_instruction=EXTRACTION_INSTRUCTION)
+        
+        # 供應商端的上下文快取；指示太短或帳號不支援時改用上面的本機模型
+        self._cached_model = None
+        self._cache_expires = 0.0
+        self._cache_retry_at = 0.0
+        self._cache_supported = _estimate_tokens(EXTRACTION_INSTRUCTION) >= MIN_CACHE_TOKENS
+        self._cache_lock = threading.Lock()
+    
+    def _context_model(self):
+        """
+        取得帶有提取指示的模型：優先使用 Gemini 上下文快取（指示只計費一次），
+        無法建立快取時使用以 system_instruction 設定的本機模型
+        """
+        with self._cache_lock:
+            if not self._cache_supported:
+                return self.model
+            now = time.time()
+            if self._cached_model is not None and now < self._cache_expires:
+                return self._cached_model
+            if now < self._cache_retry_at:
+                return self.model
+            try:
+                from google.generativeai import caching
+                cache = caching.CachedContent.create(
+                    model=f"models/{self.MODEL_NAME}",
+                    display_name="exam-extraction-instruction",
+                    system_instruction=EXTRACTION_INSTRUCTION,
+                    ttl=CACHE_TTL_SECONDS,
+                )
+                self._cached_model = genai.GenerativeModel.from_cached_content(cache)
+                # 提前一分鐘更新，避免請求途中快取過期
+                self._cache_expires = time.time() + CACHE_TTL_SECONDS - 60
+                return self._cached_model
+            except Exception as e:
+                self._cached_model = None
+                if _cache_unsupported(e):
+                    print(f"Gemini 上下文快取不適用，改用系統指示：{e}")
+                    self._cache_supported = False
+                else:
+                    print(f"暫時無法建立 Gemini 上下文快取，{CACHE_RETRY_SECONDS} 秒後重試：{e}")
+                    self._cache_retry_at = now + CACHE_RETRY_SECONDS
+                return self.model
     
-    def pdf_to_images(self, pdf_bytes: bytes) -> List[bytes]:
+    def pdf_to_images(self, pdf, filename: str = "", metrics: PipelineMetrics = None) -> List[bytes]:
         """將 PDF 轉換為圖片"""
+        return [image_bytes for image_bytes, _ in self.pdf_to_pages(pdf, filename, metrics)]
+    
+    def pdf_to_pages(self, pdf, filename: str = "", metrics: PipelineMetrics = None,
+                     page_filter: PageFilter = None) -> List[Tuple[Optional[bytes], Tuple[int, int]]]:
+        """將 PDF 轉換為 (JPEG 圖片, 感知雜湊) 列表；大型文件請改用 iter_pages"""
+        document = PdfDocument.open(pdf, filename)
         try:
-            images = convert_from_bytes(pdf_bytes, dpi=200)
-            image_bytes_list = []
-            
-            for image in images:
-                # 轉換為 JPEG 以減小檔案大小
-                img_byte_arr = io.BytesIO()
-                image.save(img_byte_arr, format='JPEG', quality=95)
-                image_bytes_list.append(img_byte_arr.getvalue())
-            
-            return image_bytes_list
+            return [(image_bytes, hashes) for _, image_bytes, hashes in self.iter_pages(document, metrics, page_filter)]
         except Exception as e:
             print(f"PDF 轉換失敗：{e}")
             return []
+        finally:
+            if document is not pdf:
+                document.close()
     
-    def extract_with_gemini(self, image_bytes: bytes, page_num: int = 1) -> List[Dict]:
-        """使用 Gemini Vision 提取單頁圖片中的題目"""
+    def iter_pages(self, document: PdfDocument, metrics: PipelineMetrics = None,
+                   page_filter: PageFilter = None) -> Iterator[Tuple[int, Optional[bytes], Tuple[int, int]]]:
+        """
+        逐頁產生 (頁碼, JPEG 圖片, 感知雜湊)；一次只轉換一頁，記憶體用量不隨頁數增加
+        傳入 page_filter 時，判定不含題目的頁面不做 JPEG 編碼，圖片欄位為 None
+        """
+        filename = document.name
+        texts = []
+        if page_filter is not None:
+            # 文字層一次取得（頁數多時並行），轉圖仍逐頁進行
+            with maybe_span(metrics, 'prefilter', filename):
+                texts = document.texts()
+        
+        for page_num in range(1, document.page_count + 1):
+            try:
+                with maybe_span(metrics, 'convert', filename, page_num):
+                    image = document.render_page(page_num, dpi=200)
+            except Exception as e:
+                print(f"PDF 轉換失敗（{filename} 第 {page_num} 頁）：{e}")
+                yield page_num, None, (0, 0)
+                continue
+            
+            if page_filter is not None:
+                with maybe_span(metrics, 'prefilter', filename, page_num):
+                    text = texts[page_num - 1] if page_num <= len(texts) else ""
+                    decision = page_filter.classify(image, text, filename, page_num)
+                if not decision['keep']:
+                    with maybe_span(metrics, 'prefilter_skip', filename, page_num):
+                        yield page_num, None, (0, 0)
+                    continue
+            
+            with maybe_span(metrics, 'phash', filename, page_num):
+                hashes = page_hash(image)
+            
+            # 轉換為 JPEG 以減小檔案大小
+            with maybe_span(metrics, 'jpeg_encode', filename, page_num):
+                img_byte_arr = io.BytesIO()
+                image.save(img_byte_arr, format='JPEG', quality=95)
+            del image
+            yield page_num, img_byte_arr.getvalue(), hashes
+    
+    def extract_with_gemini(self, image_bytes: bytes, page_num: int = 1, filename: str = "",
+                            metrics: PipelineMetrics = None, previous_tail: str = "",
+                            budget: ExtractionBudget = None) -> List[Dict]:
+        """使用 Gemini Vision 提取單頁圖片中的題目；呼叫或解析失敗時回傳 None"""
+        results = self.extract_pages([(page_num, image_bytes)], filename, metrics, previous_tail, budget)
+        return None if results is None else results[page_num]
+    
+    def extract_pages(self, pages: List[Tuple[int, bytes]], filename: str = "", metrics: PipelineMetrics = None,
+                      previous_tail: str = "", budget: ExtractionBudget = None) -> Optional[Dict[int, List[Dict]]]:
+        """
+        一次請求提取多頁 (頁碼, JPEG 圖片) 的題目，回傳 {頁碼: 從該頁開始的題目}；
+        呼叫或解析失敗時回傳 None
+        """
+        page_nums = [page_num for page_num, _ in pages]
+        first_page = page_nums[0]
         try:
             # 將圖片轉換為 PIL Image
             from PIL import Image
-            image = Image.open(io.BytesIO(image_bytes))
             
-            # 構建提示詞
-            prompt = """你是一位法律教授。請仔細分析這張圖片中的所有法律題目。
-
-請以 JSON 格式返回提取的所有題目，格式如下：
-{
-    "questions": [
-        {
-            "question_text": "完整的題目內容（一字不漏）",
-            "answer_text": "完整的解答內容（如果有的話，一字不漏）",
-            "subject": "科目（民法/刑法/民訴/刑訴/行政法/商法/智財法/勞動法/環保法/稅法）",
-            "type": "題型（申論題/案例題/選擇題）",
-            "difficulty": "難度（簡單/中等/困難）"
-        }
-    ]
-}
-
-重要提示：
-1. 完整保留原文，一字不漏，不要竄改
-2. 如果有案例，請完整保留案例內容
-3. 如果有解答，請完整保留解答內容
-4. 自動判斷科目（根據題目內容）
-5. 自動判斷題型
-6. 只返回 JSON，不要其他文字
-7. 如果找不到題目，返回空的 questions 陣列"""
+            # 每次請求只送出簡短的頁面提示；完整指示已放在系統指示（快取）中，
+            # 每張圖片前標上頁碼，模型才能回報題目所在的頁面
+            prompt = build_pages_prompt(page_nums, previous_tail)
+            contents = [prompt]
+            for page_num, image_bytes in pages:
+                contents += [f"第 {page_num} 頁", Image.open(io.BytesIO(image_bytes))]
             
             # 調用 Gemini API
-            response = self.model.generate_content([prompt, image])
-            response_text = response.text
+            with maybe_span(metrics, 'model_call', filename, first_page) as span:
+                response = self._context_model().generate_content(contents)
+                response_text = response.text
+                span.model = self.MODEL_NAME
+                span.bytes_sent = sum(len(image_bytes) for _, image_bytes in pages) + len(prompt.encode('utf-8'))
+                usage = getattr(response, 'usage_metadata', None)
+                if usage is not None:
+                    span.input_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+                    span.output_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+                    span.cached_tokens = getattr(usage, 'cached_content_token_count', 0) or 0
+            if budget is not None:
+                budget.charge(pages=len(pages), tokens=span.input_tokens + span.output_tokens)
             
-            # 嘗試提取 JSON
-            json_match = re.search(r'\{[\s\S]*\}', response_text)
-            if json_match:
-                result = json.loads(json_match.group())
-                return result.get("questions", [])
-            else:
-                print(f"無法解析 Gemini 返回的 JSON（第 {page_num} 頁）")
-                return []
+            # 嘗試提取 JSON；多頁的輸出超過 token 上限時 JSON 會被截斷
+            with maybe_span(metrics, 'json_parse', filename, first_page):
+                json_match = re.search(r'\{[\s\S]*\}', response_text)
+                try:
+                    result = json.loads(json_match.group()) if json_match else None
+                except ValueError:
+                    result = None
+            
+            by_page = None
+            if result is not None:
+                # 依模型回報的起始頁分組；頁碼缺漏或不在本次請求中時歸到前一個有效頁碼
+                by_page = {page_num: [] for page_num in page_nums}
+                page = first_page
+                for q in result.get("questions", []):
+                    try:
+                        reported = int(q.get('page'))
+                    except (TypeError, ValueError):
+                        reported = None
+                    if reported in by_page and reported >= page:
+                        page = reported
+                    by_page[page].append(q)
+            
+            if metrics is not None:
+                # 一次請求的用量拆到各頁：輸入依圖片大小、輸出依各頁題目的字數分攤
+                output_weights = None
+                if by_page is not None:
+                    output_weights = [sum(len(q.get('question_text') or '') + len(q.get('answer_text') or '')
+                                          for q in by_page[p]) for p in page_nums]
+                metrics.split(span, page_nums, [len(image_bytes) for _, image_bytes in pages], output_weights)
+            
+            if by_page is None:
+                print(f"無法解析 Gemini 返回的 JSON（第 {_page_list(page_nums)} 頁）")
+            return by_page
         
         except Exception as e:
-            print(f"Gemini 提取失敗（第 {page_num} 頁）：{e}")
-            return []
+            print(f"Gemini 提取失敗（第 {_page_list(page_nums)} 頁）：{e}")
+            return None
     
-    def extract_from_pdf(self, pdf_bytes: bytes, filename: str = "") -> List[Dict]:
-        """從 PDF 提取所有題目"""
-        # 轉換為圖片
-        images = self.pdf_to_images(pdf_bytes)
+    def extract_from_pdf(self, pdf, filename: str = "", metrics: PipelineMetrics = None,
+                         dedup: PageDeduplicator = None, page_filter: PageFilter = None,
+                         context_tail: Optional[int] = 0, budget: ExtractionBudget = None,
+                         pages_per_request: int = PAGES_PER_REQUEST,
+                         on_page: Callable[[int], None] = None) -> List[Dict]:
+        """
+        從 PDF 提取所有題目；pdf 可為 PdfDocument（上傳時已暫存到磁碟）、PDF 位元組或檔案路徑
+        連續的頁面每 pages_per_request 頁合為一次請求，同一請求內的跨頁題目由模型合併為一題；
+        傳入 page_filter 時，判定不含題目的頁面不會呼叫模型；
+        傳入 dedup 時，本批次重複或索引中已知的頁面不會再呼叫模型；
+        context_tail > 0（None 表示 CONTEXT_TAIL_CHARS）時，每次請求會附上前一頁最後一題的結尾，
+        跨請求的題目也會合併為一題，但每次請求會多出這段文字的 token；
+        傳入 budget 時，預算用完或被取消後不再呼叫模型，回傳已提取的題目，未處理的頁面記錄在 budget.skipped；
+        傳入 on_page 時，每處理完一頁（含略過的頁面）以頁碼呼叫，供顯示進度
+        """
+        if budget is not None:
+            reason = budget.exhausted()
+            if reason:
+                budget.note_skipped(filename, None, reason)
+                return []
         
-        if not images:
-            print("❌ 無法轉換 PDF 為圖片")
+        document = PdfDocument.open(pdf, filename)
+        try:
+            return self._extract_document(document, metrics, dedup, page_filter, context_tail, budget,
+                                          pages_per_request, on_page or (lambda page_num: None))
+        except Exception as e:
+            print(f"❌ 無法讀取 PDF：{e}")
+            if budget is not None:
+                budget.note_skipped(filename, None, f"無法讀取 PDF：{e}")
             return []
+        finally:
+            if document is not pdf:
+                document.close()
+    
+    def _extract_document(self, document: PdfDocument, metrics: PipelineMetrics, dedup: PageDeduplicator,
+                          page_filter: PageFilter, context_tail: Optional[int],
+                          budget: ExtractionBudget, pages_per_request: int,
+                          on_page: Callable[[int], None]) -> List[Dict]:
+        filename = document.name
         
+        if context_tail is None:
+            context_tail = CONTEXT_TAIL_CHARS
+        pages_per_request = max(1, pages_per_request or 1)
         all_questions = []
+        previous_tail = ""
+        pending = []  # 等待一起送出的 (頁碼, JPEG 圖片, 感知雜湊)
+        
+        def flush():
+            """送出累積的頁面"""
+            if pending:
+                batch = pending[:]
+                pending.clear()
+                send(batch)
         
-        # 處理每一頁
-        for page_num, image_bytes in enumerate(images, 1):
-            print(f"正在處理第 {page_num} 頁...")
+        def send(batch):
+            """一次請求送出 batch；只有這次請求的第一題可能是前一頁最後一題的延續"""
+            nonlocal previous_tail
+            page_nums = [page_num for page_num, _, _ in batch]
+            print(f"正在處理第 {_page_list(page_nums)} 頁...")
             
-            # 使用 Gemini 提取
-            questions = self.extract_with_gemini(image_bytes, page_num)
+            results = self.extract_pages(
+                [(page_num, image_bytes) for page_num, image_bytes, _ in batch],
+                filename, metrics, previous_tail, budget
+            )
+            if results is None and len(batch) > 1:
+                # 呼叫失敗或輸出被截斷（多頁「一字不漏」的輸出可能超過 token 上限）：逐頁重試
+                print(f"第 {_page_list(page_nums)} 頁提取失敗，改為逐頁重試")
+                for i, item in enumerate(batch):
+                    reason = budget.exhausted() if budget is not None else None
+                    if reason:
+                        budget.note_skipped(filename, [page_num for page_num, _, _ in batch[i:]], reason)
+                        for page_num, _, _ in batch[i:]:
+                            on_page(page_num)
+                        return
+                    send([item])
+                return
+            if results is None and budget is not None:
+                # 逐頁也失敗：記錄在預算的未處理頁面中，部分結果會說明哪些頁面沒有題目
+                budget.note_skipped(filename, page_nums, "AI 提取失敗")
             
-            # 合併結果
-            if questions:
-                for q in questions:
+            first = True
+            for page_num, _, hashes in batch:
+                questions = None if results is None else results[page_num]
+                if dedup is not None and questions is not None:
+                    dedup.record(hashes, questions, f"{filename} 第 {page_num} 頁")
+                for q in questions or []:
+                    if first and previous_tail and _is_continuation(q) and all_questions:
+                        last = all_questions[-1]
+                        last['question_text'] = last.get('question_text', '') + q.get('question_text', '')
+                        if q.get('answer_text'):
+                            last['answer_text'] = (last.get('answer_text') or '') + q['answer_text']
+                        first = False
+                        continue
+                    first = False
                     q["page"] = page_num
                     q["source_file"] = filename
                     all_questions.append(q)
+                on_page(page_num)
+            
+            previous_tail = ""
+            if context_tail > 0 and results and any(results.values()) and all_questions:
+                previous_tail = all_questions[-1].get('question_text', '')[-context_tail:]
+        
+        # 逐頁轉換，連續的頁面累積後一起送出
+        for page_num, image_bytes, hashes in self.iter_pages(document, metrics, page_filter):
+            if image_bytes is None:
+                flush()
+                previous_tail = ""
+                on_page(page_num)
+                continue
+            
+            if dedup is not None:
+                if any(dedup.same(hashes, queued) for _, _, queued in pending):
+                    # 與等待送出的頁面相同：該頁的題目會由那一頁輸出
+                    print(f"第 {page_num} 頁與等待處理的頁面相同，略過")
+                    with maybe_span(metrics, 'dedup_skip', filename, page_num):
+                        dedup.skipped += 1
+                    on_page(page_num)
+                    continue
+                skip, reused = dedup.check(hashes)
+                if skip:
+                    flush()
+                    print(f"第 {page_num} 頁與已處理頁面相同，略過")
+                    with maybe_span(metrics, 'dedup_skip', filename, page_num):
+                        questions = reused
+                    for q in questions:
+                        q = dict(q)  # 沿用的結果可能被多頁共用，複製後再標上頁碼
+                        q["page"] = page_num
+                        q["source_file"] = filename
+                        all_questions.append(q)
+                    previous_tail = ""
+                    on_page(page_num)
+                    continue
+            
+            if budget is not None:
+                reason = budget.exhausted()
+                if reason:
+                    remaining = [p for p, _, _ in pending] + list(range(page_num, document.page_count + 1))
+                    pending.clear()
+                    print(f"{reason}，{filename} 剩餘 {len(remaining)} 頁未處理")
+                    budget.note_skipped(filename, remaining, reason)
+                    break
+            
+            pending.append((page_num, image_bytes, hashes))
+            limit = pages_per_request
+            if budget is not None:
+                # 頁數上限快到時提早送出，不讓一次請求超過剩餘頁數
+                remaining_pages = budget.remaining_pages()
+                if remaining_pages is not None:
+                    limit = min(limit, max(1, remaining_pages))
+            if len(pending) >= limit:
+                flush()
+        
+        flush()
         
-        # 轉換為標準格式
+        # 轉換為標準格式；ID 由檔案內容雜湊、頁碼與頁內序號組成，不同檔案、不同批次不會重複，
+        # 同一份 PDF 重新提取則得到相同的 ID
+        file_key = document.content_hash()[:8]
+        page_counts = {}
         formatted_questions = []
-        for idx, q in enumerate(all_questions, 1):
+        for q in all_questions:
+            page = q.get('page', 0)
+            page_counts[page] = page_counts.get(page, 0) + 1
             formatted_questions.append({
-                'ID': f"{idx:03d}",
+                'ID': f"{file_key}-p{page:03d}-{page_counts[page]:02d}",
                 '類型': q.get('type', '申論題'),
                 '科目': q.get('subject', '法律'),
                 '題目內容': q.get('question_text', ''),
@@ -142,13 +415,53 @@ class GeminiPDFExtractor:
         return difficulty_map.get(difficulty, 50)
 
 
-def extract_legal_questions_with_gemini_vision(pdf_bytes: bytes, filename: str = "", api_key: str = None) -> List[Dict]:
+def _page_list(page_nums: List[int]) -> str:
+    return '、'.join(str(p) for p in page_nums)
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗估 token 數：中日韓文字約一字一 token，其他字元約四字一 token"""
+    cjk = sum(1 for c in text if ord(c) >= 0x2E80)
+    return cjk + (len(text) - cjk) // 4
+
+
+def _cache_unsupported(error: Exception) -> bool:
+    """指示太短、模型或帳號不支援快取等重試也不會成功的錯誤；逾時、配額等暫時性錯誤回傳 False"""
+    try:
+        from google.api_core import exceptions
+        if isinstance(error, (exceptions.InvalidArgument, exceptions.PermissionDenied,
+                              exceptions.NotFound, exceptions.MethodNotImplemented)):
+            return True
+    except ImportError:
+        pass
+    message = str(error).lower()
+    return any(key in message for key in ('minimum', 'too small', 'not supported', 'unsupported'))
+
+
+def _is_continuation(question: Dict) -> bool:
+    value = question.get('continued', False)
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes', '是')
+    return bool(value)
+
+
+@lru_cache(maxsize=None)
+def get_gemini_extractor(api_key: str = None) -> GeminiPDFExtractor:
+    """
+    取得共用的提取器：每個程序（與每個 API Key）只呼叫一次 genai.configure 並建立一次模型，
+    後續檔案沿用同一個客戶端與其連線
+    """
+    return GeminiPDFExtractor(api_key=api_key)
+
+
+def extract_legal_questions_with_gemini_vision(pdf_bytes: bytes, filename: str = "", api_key: str = None,
+                                               metrics: PipelineMetrics = None) -> List[Dict]:
     """
     便利函數：使用 Gemini Vision 提取法律題目
     """
     try:
-        extractor = GeminiPDFExtractor(api_key=api_key)
-        return extractor.extract_from_pdf(pdf_bytes, filename)
+        extractor = get_gemini_extractor(api_key)
+        return extractor.extract_from_pdf(pdf_bytes, filename, metrics)
     except Exception as e:
         print(f"Gemini 初始化失敗：{e}")
         return []
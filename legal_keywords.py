@@ -0,0 +1,29 @@
+"""
+法律題目的共用關鍵詞與分隔符號
+"""
+
+# 法律科目關鍵詞
+LEGAL_SUBJECTS = {
+    '民法': ['民法', '物權', '債權', '親屬', '繼承', '契約', '買賣', '租賃', '抵押', '質權'],
+    '刑法': ['刑法', '犯罪', '故意', '過失', '搶劫', '竊盜', '詐欺', '傷害', '殺人', '強制'],
+    '民訴': ['民訴', '民事訴訟', '管轄', '訴訟', '上訴', '再審', '和解', '調解', '證據', '舉證'],
+    '刑訴': ['刑訴', '刑事訴訟', '偵查', '起訴', '審判', '證人', '被告', '檢察官', '法官'],
+    '行政法': ['行政法', '行政處分', '行政程序', '行政救濟', '訴願', '行政訴訟', '公務員'],
+    '商法': ['商法', '公司', '股份', '董事', '監察', '商人', '商業帳簿', '票據', '支票'],
+    '智財法': ['智慧財產', '著作權', '專利', '商標', '營業秘密', '積體電路'],
+    '勞動法': ['勞動法', '勞工', '雇主', '薪資', '工時', '休假', '工會', '爭議'],
+    '環保法': ['環保', '環境', '污染', '廢棄物', '空氣', '水質', '環評'],
+    '稅法': ['稅法', '所得稅', '營業稅', '關稅', '遺產稅', '贈與稅'],
+}
+
+# 題目和答案的分隔符號
+QUESTION_SEPARATORS = [
+    r'(?:^|\n)(?:【|＜|<)?(?:題目|問題|案例|例題)(?:】|＞|>)?[\s]*(?::|：)',
+    r'(?:^|\n)(?:第\s*[一二三四五六七八九十\d]+\s*題)',
+    r'(?:^|\n)(?:Q\d+|q\d+)',
+]
+
+ANSWER_SEPARATORS = [
+    r'(?:^|\n)(?:【|＜|<)?(?:答案|解答|參考解答|說明)(?:】|＞|>)?[\s]*(?::|：)',
+    r'(?:^|\n)(?:【|＜|<)?(?:解|答)(?:】|＞|>)?[\s]*(?::|：)',
+]
@@ -0,0 +1,460 @@
+"""
+多工作階段壓力測試
+啟動實際的 `streamlit run app.py` 伺服器，以多條 websocket 連線（與瀏覽器相同的協定）同時模擬
+多位老師操作：載入題庫 → 篩選 → 出卷 → 打包匯出；每個工作階段在伺服器上各有自己的重跑執行緒，
+與正式環境一樣真正同時執行。題庫由本機 HTTP 伺服器提供合成的 CSV（代替 Google Sheets 匯出網址），
+回報各動作的重跑延遲百分位數，以及伺服器程序在工作階段仍連線時每個工作階段增加的記憶體
+
+需要 websockets 套件（新版 Streamlit 已內含；舊版請 pip install websockets）
+
+用法：
+    python load_test.py --rows 1000 10000 100000 --sessions 8 --iterations 3
+    python load_test.py --rows 1000000 --sessions 4 --json result.json
+    python load_test.py --baseline result.json --tolerance 0.25   # 延遲退步超過 25% 時以非零狀態結束
+"""
+
+import argparse
+import asyncio
+import http.server
+import json
+import os
+import random
+import re
+import socket
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+ACTIONS = ['load', 'filter', 'generate', 'export']
+
+SUBJECTS = ['民法', '刑法', '民訴', '刑訴', '行政法', '商法', '智財法', '勞動法']
+TYPES = ['申論題', '案例題', '選擇題']
+PHRASES = [
+    '甲以其所有之房屋設定抵押權予乙', '嗣後甲將該房屋出賣並移轉登記予丙', '試問乙之抵押權是否受影響',
+    '某甲涉嫌竊盜', '警察未持搜索票進入住宅搜索', '所扣押之證據有無證據能力', '行政處分之撤銷與廢止有何不同',
+    '股東會決議違反章程', '董事未盡善良管理人之注意義務', '雇主片面變更工作規則', '專利權人主張侵權',
+    '原告起訴後變更訴之聲明', '被告於審判期日無正當理由不到庭', '請說明其法律效果', '並附理由說明之',
+]
+
+
+# ==================== 合成題庫與 CSV 伺服器 ====================
+def make_bank(rows: int, seed: int = 0) -> pd.DataFrame:
+    """產生 rows 題的合成題庫（題目由常見法律語句隨機組合，長度約 60～300 字）"""
+    rng = np.random.default_rng(seed)
+    pool_size = min(rows, 5000)
+    pool = np.array([
+        '，'.join(rng.choice(PHRASES, rng.integers(3, 12))) + '？' for _ in range(pool_size)
+    ], dtype=object)
+    ids = pd.Series(np.arange(rows)).map('Q{:07d}'.format)
+    return pd.DataFrame({
+        'ID': ids,
+        '類型': rng.choice(TYPES, rows),
+        '科目': rng.choice(SUBJECTS, rows),
+        '題目內容': pool[rng.integers(0, pool_size, rows)] + '（' + ids + '）',
+        '參考解答': '參考解答 ' + ids,
+        '分數': rng.choice([5, 10, 20, 25, 50], rows),
+    })
+
+
+class _CsvHandler(http.server.BaseHTTPRequestHandler):
+    """GET /synthetic-{rows}.csv 回傳對應大小的合成題庫"""
+
+    protocol_version = 'HTTP/1.1'
+    cache: Dict[int, bytes] = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        match = re.match(r'^/synthetic-(\d+)\.csv$', self.path)
+        if not match:
+            self.send_error(404)
+            return
+        rows = int(match.group(1))
+        with self.lock:
+            if rows not in self.cache:
+                self.cache[rows] = make_bank(rows).to_csv(index=False).encode('utf-8')
+            body = self.cache[rows]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def start_csv_server() -> str:
+    """啟動本機 CSV 伺服器，回傳可填入 SHEETS_EXPORT_URL 的網址樣板"""
+    server = _Server(('127.0.0.1', 0), _CsvHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/{{sheet_id}}.csv"
+
+
+# ==================== Streamlit 伺服器 ====================
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def streamlit_server(env: Dict[str, str], startup_timeout: float = 60):
+    """以子程序啟動 streamlit run app.py，回傳 (websocket 網址, 伺服器 PID)；結束時關閉伺服器"""
+    port = _free_port()
+    log = tempfile.NamedTemporaryFile('w+b', prefix='load-test-streamlit-', suffix='.log', delete=False)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', APP_PATH,
+         '--server.headless', 'true', '--server.port', str(port),
+         '--server.fileWatcherType', 'none', '--browser.gatherUsageStats', 'false'],
+        env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT,
+    )
+    try:
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"Streamlit 伺服器無法啟動，請查看 {log.name}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                time.sleep(0.2)
+        yield f"ws://127.0.0.1:{port}/_stcore/stream", process.pid
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+
+
+# ==================== 記憶體 ====================
+def rss_bytes(pid: int) -> Optional[int]:
+    """伺服器程序的常駐記憶體；讀 /proc，非 Linux 平台回傳 None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+async def sample_peak_rss(pid: int, stop: asyncio.Event, interval: float = 0.05) -> Optional[int]:
+    """
+    量測期間定期取樣伺服器 RSS，回傳最大值；結束時的 RSS 會因配置器把暫時配置
+    （匯出的 ZIP、DataFrame 複本等）還給系統而低於開始時，峰值則不會低於基準
+    """
+    peak = None
+    while not stop.is_set():
+        value = rss_bytes(pid)
+        if value is not None:
+            peak = value if peak is None else max(peak, value)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+    return peak
+
+
+# ==================== 工作階段 ====================
+class Session:
+    """
+    一位使用者：一條連到伺服器的 websocket；每個動作送出一次（或數次）重跑並等待執行完畢
+    與瀏覽器相同，每次重跑都送出所有已設定的 widget 值，按鈕只在按下的那次送出
+    """
+
+    def __init__(self, url: str, sheet_id: str, seed: int, timeout: float):
+        self.url = url
+        self.sheet_id = sheet_id
+        self.random = random.Random(seed)
+        self.timeout = timeout
+        self.ws = None
+        self.widgets: Dict[str, object] = {}  # widget ID → WidgetState
+        self.elements: List = []  # 上一次重跑畫出的 (元素種類, proto)
+        self.timings: List[Dict] = []
+        self.errors: List[str] = []
+
+    async def connect(self):
+        import websockets
+        self.ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def rerun(self, *triggers: str):
+        """送出一次重跑（triggers 為按下的按鈕 ID），收集畫出的元素直到重跑結束"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.widget_states.widgets.extend(self.widgets.values())
+        for widget_id in triggers:
+            state = message.rerun_script.widget_states.widgets.add()
+            state.id = widget_id
+            state.trigger_value = True
+        await self.ws.send(message.SerializeToString())
+
+        elements = []
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await asyncio.wait_for(self.ws.recv(), self.timeout))
+            kind = forward.WhichOneof('type')
+            if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_kind = element.WhichOneof('type')
+                elements.append((element_kind, getattr(element, element_kind)))
+                if element_kind == 'exception':
+                    raise RuntimeError(element.exception.message)
+            elif kind == 'script_finished':
+                if forward.script_finished != ForwardMsg.FINISHED_SUCCESSFULLY:
+                    raise RuntimeError(f"重跑未正常結束：{forward.script_finished}")
+                break
+        self.elements = elements
+
+    def find(self, kind: str, label: Optional[str] = None, key: Optional[str] = None):
+        """上一次重跑畫出的 widget；有 key 時以 ID 結尾比對，否則以標籤比對"""
+        for element_kind, proto in self.elements:
+            if element_kind != kind:
+                continue
+            if key is not None and proto.id.endswith(f"-{key}"):
+                return proto
+            if key is None and proto.label == label:
+                return proto
+        raise LookupError(f"找不到 {kind}：{key or label}")
+
+    def set_value(self, kind: str, value, label: Optional[str] = None, key: Optional[str] = None):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        proto = self.find(kind, label, key)
+        state = WidgetState(id=proto.id)
+        if isinstance(value, list):
+            state.string_array_value.data.extend(value)
+        elif isinstance(value, str):
+            state.string_value = value
+        elif isinstance(value, int):
+            state.int_value = value
+        else:
+            state.double_value = value
+        self.widgets[proto.id] = state
+
+    def value(self, key: str) -> Optional[str]:
+        for state in self.widgets.values():
+            if state.id.endswith(f"-{key}"):
+                return state.string_value
+        return None
+
+    def button(self, label: str) -> str:
+        return self.find('button', label).id
+
+    async def _timed(self, action: str, fn):
+        started = time.perf_counter()
+        try:
+            await fn()
+        except Exception as e:
+            self.errors.append(f"{action}：{e or type(e).__name__}")
+        self.timings.append({'action': action, 'seconds': time.perf_counter() - started})
+
+    async def load(self):
+        async def run():
+            await self.rerun()
+            self.set_value('text_input', self.sheet_id, key="sheet_id_main")
+            await self.rerun()
+        await self._timed('load', run)
+
+    async def filter(self):
+        async def run():
+            if self.value("sheet_id_mgmt") != self.sheet_id:
+                # 第一次篩選時題庫管理頁才載入（共用快取中的題庫）
+                self.set_value('text_input', self.sheet_id, key="sheet_id_mgmt")
+                await self.rerun()
+            self.set_value('text_input', self.random.choice(['抵押權', '證據', '董事', 'Q00001']), key="mgmt_keyword")
+            await self.rerun()
+        await self._timed('filter', run)
+
+    async def generate(self):
+        """每位使用者每次選不同的科目與目標分數，避免只量到相同條件的快取命中"""
+        async def run():
+            subjects = list(self.find('multiselect', "選擇科目").options)
+            self.set_value('multiselect', self.random.sample(subjects, self.random.randint(1, len(subjects))),
+                           label="選擇科目")
+            max_score = int(self.find('number_input', "目標分數").max)
+            self.set_value('number_input', self.random.randrange(5, max(10, min(max_score, 300)), 5),
+                           label="目標分數")
+            await self.rerun(self.button("🎲 隨機生成考卷"))
+        await self._timed('generate', run)
+
+    async def export(self, poll_interval: float = 0.2, limit: float = 120):
+        """打包 2-5 個版本（每次隨機），直到可以下載 ZIP 為止（包含輪詢的重跑）"""
+        async def run():
+            self.set_value('number_input', self.random.randint(2, 5), label="版本數")
+            await self.rerun(self.button("📦 開始打包"))
+            deadline = time.perf_counter() + limit
+            while not any(kind == 'download_button' and 'ZIP' in proto.label for kind, proto in self.elements):
+                if time.perf_counter() > deadline:
+                    raise TimeoutError("打包逾時")
+                await asyncio.sleep(poll_interval)
+                await self.rerun(self.button("🔄 更新進度"))
+        await self._timed('export', run)
+
+    async def run(self, iterations: int):
+        await self.load()
+        for _ in range(iterations):
+            await self.filter()
+            await self.generate()
+            await self.export()
+
+
+# ==================== 執行與報告 ====================
+def percentiles(values: List[float]) -> Dict[str, float]:
+    array = np.asarray(values)
+    return {
+        'count': len(values),
+        'p50': float(np.percentile(array, 50)),
+        'p90': float(np.percentile(array, 90)),
+        'p95': float(np.percentile(array, 95)),
+        'p99': float(np.percentile(array, 99)),
+        'max': float(array.max()),
+        'mean': float(statistics.fmean(values)),
+    }
+
+
+async def run_scenario(url: str, server_pid: int, rows: int, sessions: int, iterations: int,
+                       timeout: float) -> Dict:
+    """N 個工作階段同時操作 rows 題的題庫"""
+    sheet_id = f"synthetic-{rows}"
+
+    # 先讓一個工作階段完整走過一次各動作，題庫、相似度索引等共用快取都已建立，
+    # 之後的記憶體差異才是各工作階段本身的用量；暖身的工作階段保持連線到量測結束
+    warmup = Session(url, sheet_id, seed=-1, timeout=timeout)
+    await warmup.connect()
+    await warmup.run(1)
+    cold_load = warmup.timings[0]['seconds']
+    baseline = rss_bytes(server_pid)
+
+    users = [Session(url, sheet_id, seed=i, timeout=timeout) for i in range(sessions)]
+    await asyncio.gather(*(user.connect() for user in users))
+    stop = asyncio.Event()
+    peak_task = asyncio.create_task(sample_peak_rss(server_pid, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(user.run(iterations) for user in users))
+    elapsed = time.perf_counter() - started
+
+    # 工作階段仍連線時量測：各自的 session_state（考卷、匯出結果等）都還在伺服器記憶體中
+    after = rss_bytes(server_pid)
+    stop.set()
+    peak = await peak_task
+    for session in [warmup, *users]:
+        await session.close()
+
+    by_action = defaultdict(list)
+    for user in users:
+        for timing in user.timings:
+            by_action[timing['action']].append(timing['seconds'])
+
+    memory_known = baseline is not None and after is not None and peak is not None
+    return {
+        'rows': rows,
+        'sessions': sessions,
+        'iterations': iterations,
+        'cold_load_s': cold_load,
+        'wall_s': elapsed,
+        'rss_baseline_mb': baseline / 2**20 if memory_known else None,
+        'rss_after_mb': after / 2**20 if memory_known else None,
+        'rss_peak_mb': peak / 2**20 if memory_known else None,
+        # 同時操作時每個工作階段佔用的記憶體（峰值）與全部操作完、仍連線時保留的記憶體
+        'mb_per_session': (peak - baseline) / 2**20 / sessions if memory_known else None,
+        'retained_mb_per_session': (after - baseline) / 2**20 / sessions if memory_known else None,
+        'latency': {action: percentiles(by_action[action]) for action in ACTIONS if by_action[action]},
+        'errors': [error for user in [warmup, *users] for error in user.errors][:20],
+    }
+
+
+def print_report(results: List[Dict]):
+    print(f"{'題數':>9} {'動作':<9} {'次數':>5} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for result in results:
+        for action, stats in result['latency'].items():
+            print(f"{result['rows']:>9} {action:<9} {stats['count']:>5} "
+                  f"{stats['p50']:>8.3f} {stats['p90']:>8.3f} {stats['p95']:>8.3f} {stats['p99']:>8.3f} {stats['max']:>8.3f}")
+        if result['mb_per_session'] is None:
+            memory = "無法取得伺服器記憶體（僅支援 Linux）"
+        else:
+            memory = (f"每個峰值約 {result['mb_per_session']:.1f} MB、結束後保留約 {result['retained_mb_per_session']:.1f} MB"
+                      f"（伺服器 RSS {result['rss_baseline_mb']:.0f} → 峰值 {result['rss_peak_mb']:.0f} → "
+                      f"{result['rss_after_mb']:.0f} MB）")
+        print(f"{result['rows']:>9} 首次載入 {result['cold_load_s']:.2f} 秒；{result['sessions']} 個工作階段，{memory}")
+        for error in result['errors']:
+            print(f"{'':>9} ⚠️ {error}")
+        print()
+
+
+def compare_to_baseline(results: List[Dict], baseline_path: str, tolerance: float) -> List[str]:
+    """與先前的結果比較 p95 延遲，回傳退步超過 tolerance 的項目"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['rows'], r['sessions']): r for r in json.load(f)}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result['rows'], result['sessions']))
+        if previous is None:
+            continue
+        for action, stats in result['latency'].items():
+            old = previous['latency'].get(action, {}).get('p95')
+            if old and stats['p95'] > old * (1 + tolerance):
+                regressions.append(f"{result['rows']} 題 {action}：p95 {old:.3f} → {stats['p95']:.3f} 秒")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="對 streamlit run app.py 模擬多位使用者同時操作")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--sessions', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=3, help="每個工作階段重複 篩選/出卷/匯出 的次數")
+    parser.add_argument('--timeout', type=float, default=300, help="單次重跑的逾時秒數")
+    parser.add_argument('--json', help="將結果寫入 JSON 檔，可作為之後的 --baseline")
+    parser.add_argument('--baseline', help="先前的 JSON 結果；p95 退步超過 --tolerance 時回傳非零狀態")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    # 題庫改由本機伺服器提供；以環境變數傳給 Streamlit 伺服器
+    with streamlit_server({'SHEETS_EXPORT_URL': start_csv_server()}) as (url, server_pid):
+        results = [
+            asyncio.run(run_scenario(url, server_pid, rows, args.sessions, args.iterations, args.timeout))
+            for rows in args.rows
+        ]
+    print_report(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"❌ 延遲退步：{regression}")
+        if regressions:
+            return 1
+    return 1 if any(result['errors'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
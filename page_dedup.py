@@ -0,0 +1,163 @@
+"""
+以感知雜湊（dHash）辨識重複頁面
+封面、作答說明等重複頁面在呼叫模型前就略過；曾處理過的頁面直接沿用先前的提取結果
+
+每頁計算兩個雜湊：64 位元的粗雜湊用來快速找出候選頁面，
+1024 位元（32x32）的細雜湊用來確認是否真的是同一頁。
+版面相同、只差幾個字的頁面仍可能被視為相同，必要時可調低 MAX_DISTANCE。
+"""
+
+import copy
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 兩頁細雜湊的漢明距離不超過此值即視為同一頁（共 1024 位元）
+MAX_DISTANCE = 8
+
+COARSE_SIZE = 8
+FINE_SIZE = 32
+
+# 64 位元粗雜湊切成 4 段 16 位元；粗雜湊距離 ≤ 3 的兩頁至少有一段完全相同
+_BANDS = 4
+_BAND_BITS = 16
+
+
+def dhash(image, size: int = 8) -> int:
+    """計算 PIL 圖片的 size x size 位元差異雜湊（對縮放、JPEG 壓縮與輕微掃描雜訊不敏感）"""
+    from PIL import Image
+
+    small = image.convert('L').resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def page_hash(image) -> Tuple[int, int]:
+    """回傳頁面的 (粗雜湊, 細雜湊)"""
+    return dhash(image, COARSE_SIZE), dhash(image, FINE_SIZE)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def _bands(value: int) -> List[int]:
+    mask = (1 << _BAND_BITS) - 1
+    return [(i << _BAND_BITS) | ((value >> (i * _BAND_BITS)) & mask) for i in range(_BANDS)]
+
+
+class PageHashIndex:
+    """頁面雜湊 → 提取結果的索引；指定 path 時會保存到 JSON 檔，跨批次與重新啟動後仍可沿用"""
+
+    def __init__(self, path: Optional[str] = None, max_distance: int = MAX_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self._entries: Dict[int, Dict] = {}
+        self._bands: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for key, entry in json.load(f).items():
+                        self._insert((int(entry['coarse'], 16), int(key, 16)), entry)
+            except (OSError, ValueError, KeyError, AttributeError) as e:
+                # 索引只是快取：讀不到時從空索引開始，下次保存時覆蓋損毀的檔案
+                print(f"頁面雜湊索引無法讀取，改用空索引（{path}）：{e}")
+                self._entries.clear()
+                self._bands.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _insert(self, value: Tuple[int, int], entry: Dict):
+        coarse, fine = value
+        if fine not in self._entries:
+            for band in _bands(coarse):
+                self._bands.setdefault(band, []).append(fine)
+        entry['coarse'] = f"{coarse:016x}"
+        self._entries[fine] = entry
+
+    def lookup(self, value: Tuple[int, int]) -> Optional[Dict]:
+        """找出細雜湊距離最近且在門檻內的已知頁面"""
+        coarse, fine = value
+        with self._lock:
+            best, best_distance = None, self.max_distance + 1
+            for band in _bands(coarse):
+                for candidate in self._bands.get(band, []):
+                    distance = hamming(fine, candidate)
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+            return self._entries[best] if best is not None else None
+
+    def add(self, value: Tuple[int, int], questions: List[Dict], source: str = ""):
+        with self._lock:
+            self._insert(value, {'questions': questions, 'source': source})
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {f"{fine:0256x}": entry for fine, entry in self._entries.items()}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # 每次寫入各自的暫存檔再取代，多個工作階段（或程序）同時保存也不會交錯寫入同一個檔案
+        with self._save_lock:
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+
+class PageDeduplicator:
+    """
+    單一批次的重複頁面判斷
+    - 本批次已出現過的頁面：直接略過（題目已在本批次結果中，不重複輸出）
+    - 索引中有紀錄的頁面：略過模型呼叫，沿用先前的提取結果
+    """
+
+    def __init__(self, index: Optional[PageHashIndex] = None, max_distance: int = MAX_DISTANCE):
+        self.index = index if index is not None else PageHashIndex(max_distance=max_distance)
+        self.batch = PageHashIndex(max_distance=max_distance)
+        self.skipped = 0
+        self.reused = 0
+
+    def same(self, a: Tuple[int, int], b: Tuple[int, int]) -> bool:
+        """兩個頁面雜湊是否視為同一頁（與 check 的判斷標準相同）"""
+        if not set(_bands(a[0])) & set(_bands(b[0])):
+            return False
+        return hamming(a[1], b[1]) <= self.batch.max_distance
+
+    def check(self, value: Tuple[int, int]):
+        """回傳 (是否略過, 可沿用的題目)"""
+        if self.batch.lookup(value) is not None:
+            self.skipped += 1
+            return True, []
+
+        entry = self.index.lookup(value)
+        if entry is not None:
+            self.skipped += 1
+            self.reused += 1
+            self.batch.add(value, [], entry.get('source', ''))
+            return True, copy.deepcopy(entry['questions'])
+
+        return False, None
+
+    def record(self, value: Tuple[int, int], questions: List[Dict], source: str = ""):
+        """記錄成功提取的頁面（提取失敗的頁面不記錄，下次仍會重新呼叫模型）"""
+        stored = [{k: v for k, v in q.items() if k not in ('page', 'source_file')} for q in questions]
+        self.batch.add(value, stored, source)
+        self.index.add(value, stored, source)
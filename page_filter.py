@@ -0,0 +1,145 @@
+"""
+非題目頁面的本機預先篩選
+在呼叫模型前，以文字層關鍵詞、墨水密度與影像熵判斷空白頁、答案卡、目錄等頁面，
+被判定為不含題目的頁面不送出；每一頁的判斷都會記錄，方便核對召回率
+"""
+
+import json
+import math
+import re
+from typing import Dict, List, Optional
+
+from legal_keywords import LEGAL_SUBJECTS, QUESTION_SEPARATORS
+from pdf_document import PdfDocument
+
+# 預設門檻
+BLANK_INK = 0.002        # 相對底色的平均墨水量低於此值視為空白頁
+MIN_ENTROPY = 0.1        # 灰階熵低於此值（整頁幾乎只有單一色調）視為非題目頁；文字稀疏的頁面熵也不高，不宜設太大
+MIN_TEXT_CHARS = 30      # 文字層字數達到此值才以文字判斷
+MIN_TOC_LINES = 5        # 「……12」形式的目錄行數達到此值視為目錄頁
+MIN_GRID_RATIO = 0.5     # 答案卡：文字行中只有題號 / 選項代號的比例
+
+# 題目常見的提問字詞（補充 QUESTION_SEPARATORS 抓不到的題型）
+QUESTION_CUES = ['？', '?', '試問', '請問', '試述', '試說明', '試分析', '請說明', '何謂', '是否']
+
+_TOC_LINE = re.compile(r'(?:\.{3,}|…+|·{3,}|－{2,})\s*\d+\s*$')
+_GRID_LINE = re.compile(r'^\s*(?:\d+\s*[.、:]?\s*)?(?:[\(（]?\s*[A-DＡ-Ｄ]\s*[\)）]?\s*)+$')
+_SUBJECT_KEYWORDS = [keyword for keywords in LEGAL_SUBJECTS.values() for keyword in keywords]
+
+
+def ink_density(gray_image) -> float:
+    """
+    相對於紙張底色的平均墨水量（0～1）
+    以直方圖眾數作為底色，縮圖時仍大致不變，也不受掃描紙張偏灰影響
+    """
+    histogram = gray_image.histogram()
+    total = sum(histogram)
+    if not total:
+        return 0.0
+    background = max(range(256), key=lambda v: histogram[v])
+    return sum(n * (background - v) for v, n in enumerate(histogram[:background])) / (255 * total)
+
+
+def image_entropy(gray_image) -> float:
+    """灰階直方圖的 Shannon 熵（0～8）"""
+    histogram = gray_image.histogram()
+    total = sum(histogram)
+    if not total:
+        return 0.0
+    return -sum((n / total) * math.log2(n / total) for n in histogram if n)
+
+
+def page_texts(pdf) -> List[str]:
+    """讀取 PDF（PdfDocument、位元組或路徑）每頁的文字層；掃描檔或讀取失敗時回傳空字串"""
+    document = PdfDocument.open(pdf)
+    try:
+        return document.texts()
+    except Exception as e:
+        print(f"PDF 文字層讀取失敗：{e}")
+        return []
+    finally:
+        if document is not pdf:
+            document.close()
+
+
+class PageFilter:
+    """判斷頁面是否可能含有題目；門檻可在建立時調整"""
+
+    def __init__(self, blank_ink: float = BLANK_INK, min_entropy: float = MIN_ENTROPY,
+                 min_text_chars: int = MIN_TEXT_CHARS, min_toc_lines: int = MIN_TOC_LINES,
+                 min_grid_ratio: float = MIN_GRID_RATIO, log_path: Optional[str] = None):
+        self.blank_ink = blank_ink
+        self.min_entropy = min_entropy
+        self.min_text_chars = min_text_chars
+        self.min_toc_lines = min_toc_lines
+        self.min_grid_ratio = min_grid_ratio
+        self.log_path = log_path
+        self.decisions: List[Dict] = []
+
+    def classify(self, image, text: str = "", filename: str = "", page: int = 0) -> Dict:
+        """回傳判斷結果：keep 為 False 時此頁不送往模型，reason 說明原因"""
+        # 先縮小再計算，避免在 200 dpi 的整頁影像上逐像素運算
+        gray = image.convert('L')
+        gray.thumbnail((400, 400))
+        ink = ink_density(gray)
+        entropy = image_entropy(gray)
+
+        stripped = re.sub(r'\s+', '', text or '')
+        separator_hits = sum(1 for pattern in QUESTION_SEPARATORS if re.search(pattern, text or '', re.MULTILINE))
+        keyword_hits = sum(stripped.count(k) for k in _SUBJECT_KEYWORDS)
+        cue_hits = sum(stripped.count(c) for c in QUESTION_CUES)
+
+        lines = [line for line in (text or '').splitlines() if line.strip()]
+        toc_lines = sum(1 for line in lines if _TOC_LINE.search(line))
+        grid_ratio = sum(1 for line in lines if _GRID_LINE.match(line)) / len(lines) if lines else 0.0
+
+        # 文字層的題目特徵優先：有題號或提問字詞的頁面即使只有一行（例如最後一頁的短題）也保留，
+        # 墨水量與影像熵只在沒有可用文字層時才用來排除頁面
+        if separator_hits or cue_hits:
+            keep, reason = True, 'question_markers'
+        elif toc_lines >= self.min_toc_lines or '目錄' in stripped[:20]:
+            keep, reason = False, 'table_of_contents'
+        elif lines and grid_ratio >= self.min_grid_ratio:
+            keep, reason = False, 'answer_grid'
+        elif keyword_hits:
+            keep, reason = True, 'subject_keywords'
+        elif len(stripped) >= self.min_text_chars:
+            keep, reason = False, 'no_question_markers'
+        elif ink < self.blank_ink:
+            keep, reason = False, 'blank'
+        elif entropy < self.min_entropy:
+            keep, reason = False, 'low_entropy'
+        else:
+            # 沒有文字層（掃描檔）時無法以文字判斷，保守地送往模型
+            keep, reason = True, 'no_text_layer'
+
+        decision = {
+            'file': filename,
+            'page': page,
+            'keep': keep,
+            'reason': reason,
+            'ink': round(ink, 5),
+            'entropy': round(entropy, 3),
+            'text_chars': len(stripped),
+            'separator_hits': separator_hits,
+            'keyword_hits': keyword_hits,
+            'cue_hits': cue_hits,
+            'toc_lines': toc_lines,
+            'grid_ratio': round(grid_ratio, 3),
+        }
+        self.decisions.append(decision)
+        print(f"頁面篩選：{filename} 第 {page} 頁 → {'保留' if keep else '略過'}（{reason}）")
+        return decision
+
+    @property
+    def skipped(self) -> int:
+        return sum(1 for d in self.decisions if not d['keep'])
+
+    def write_log(self, path: Optional[str] = None):
+        """將判斷紀錄附加到 JSON lines 檔"""
+        path = path or self.log_path
+        if not path:
+            return
+        with open(path, 'a', encoding='utf-8') as f:
+            for decision in self.decisions:
+                f.write(json.dumps(decision, ensure_ascii=False) + "\n")
@@ -0,0 +1,317 @@
+"""
+暫存於磁碟的 PDF 文件
+上傳的 PDF 分段寫入暫存檔，之後以檔案路徑轉圖、以 mmap 讀取內容；
+文件只解析一次，文字提取、頁面篩選與逐頁轉圖共用同一個文件物件，
+記憶體用量只隨目前處理的頁面增加，不隨上傳檔案大小增加
+文字提取與轉圖的後端可替換：安裝 PyMuPDF 時使用 PyMuPDF，否則使用 PyPDF2 + poppler
+"""
+
+import contextlib
+import hashlib
+import importlib.util
+import json
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Union
+
+# 檢查 PyMuPDF 是否已安裝（原生程式庫，文字提取與轉圖都比 PyPDF2 / poppler 快）；
+# 只查找不導入，第一次開啟文件時才載入，啟動 app 時不需付出載入原生程式庫的時間
+PYMUPDF_AVAILABLE = importlib.util.find_spec('pymupdf') is not None
+
+BACKEND_PYMUPDF = 'pymupdf'
+BACKEND_PYPDF2 = 'pypdf2'  # 文字用 PyPDF2、轉圖用 pdf2image（poppler）
+
+# 可用環境變數 PDF_BACKEND 指定；未指定時有 PyMuPDF 就使用
+DEFAULT_BACKEND = os.environ.get('PDF_BACKEND') or (BACKEND_PYMUPDF if PYMUPDF_AVAILABLE else BACKEND_PYPDF2)
+
+# 暫存目錄；未設定時使用系統預設的暫存目錄
+SPOOL_DIR = os.environ.get('PDF_SPOOL_DIR')
+
+CHUNK_SIZE = 1024 * 1024
+
+# PyPDF2 後端頁數達到此值才以多個程序並行提取文字（程序啟動與各自開檔有固定成本）；
+# PyMuPDF 在原生程式碼中提取，逐頁就夠快，不另開程序
+PARALLEL_MIN_PAGES = 16
+TEXT_WORKERS = min(4, os.cpu_count() or 1)
+TEXT_TIMEOUT_SECONDS = 300
+
+
+def available_backends() -> List[str]:
+    backends = [BACKEND_PYPDF2]
+    if PYMUPDF_AVAILABLE:
+        backends.insert(0, BACKEND_PYMUPDF)
+    return backends
+
+
+# ==================== 後端 ====================
+class PyPDF2Backend:
+    """純 Python 後端：PyPDF2 讀取 mmap 提取文字，poppler 依檔案路徑轉圖"""
+
+    name = BACKEND_PYPDF2
+
+    def __init__(self, path: str):
+        import PyPDF2
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = None
+        try:
+            # 傳入路徑時 PyPDF2 會把整個檔案讀進記憶體，改傳 mmap 讓物件依需要讀取
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._reader = PyPDF2.PdfReader(self._mmap)
+        except Exception:
+            # 檔案損毀或為空檔時不留下開啟的檔案與 mmap
+            self.close()
+            raise
+
+    @property
+    def page_count(self) -> int:
+        return len(self._reader.pages)
+
+    def page_text(self, page_num: int) -> str:
+        return self._reader.pages[page_num - 1].extract_text() or ""
+
+    def render_page(self, page_num: int, dpi: int):
+        from pdf2image import convert_from_path
+        return convert_from_path(self.path, dpi=dpi, first_page=page_num, last_page=page_num)[0]
+
+    def close(self):
+        self._reader = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+
+class PyMuPDFBackend:
+    """PyMuPDF（MuPDF）後端：文字提取與轉圖都在原生程式碼中完成"""
+
+    name = BACKEND_PYMUPDF
+
+    def __init__(self, path: str):
+        self.path = path
+        import pymupdf
+        self._doc = pymupdf.open(path)
+
+    @property
+    def page_count(self) -> int:
+        return self._doc.page_count
+
+    def page_text(self, page_num: int) -> str:
+        return self._doc[page_num - 1].get_text()
+
+    def render_page(self, page_num: int, dpi: int):
+        from PIL import Image
+        pixmap = self._doc[page_num - 1].get_pixmap(dpi=dpi)
+        return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+    def close(self):
+        self._doc.close()
+
+
+def open_backend(path: str, backend: Optional[str] = None):
+    backend = backend or DEFAULT_BACKEND
+    if backend == BACKEND_PYMUPDF:
+        if not PYMUPDF_AVAILABLE:
+            raise ValueError("PyMuPDF 未安裝，無法使用 pymupdf 後端")
+        return PyMuPDFBackend(path)
+    if backend == BACKEND_PYPDF2:
+        return PyPDF2Backend(path)
+    raise ValueError(f"未知的 PDF 後端：{backend}")
+
+
+def _page_texts_worker(path: str, backend: str, first: int, last: int) -> List[str]:
+    """子程序：自行開啟檔案，提取第 first～last 頁的文字"""
+    handle = open_backend(path, backend)
+    try:
+        texts = []
+        for page_num in range(first, last + 1):
+            try:
+                texts.append(handle.page_text(page_num))
+            except Exception as e:
+                print(f"PDF 文字層讀取失敗（第 {page_num} 頁）：{e}")
+                texts.append("")
+        return texts
+    finally:
+        handle.close()
+
+
+def _page_texts_subprocess(path: str, backend: str, first: int, last: int) -> List[str]:
+    """
+    以獨立的 Python 程序執行本檔案提取文字；不經 multiprocessing 的 spawn，
+    子程序不會重新匯入 Streamlit 的主程式（app.py），只載入本模組
+    """
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), path, backend, str(first), str(last)],
+        capture_output=True, timeout=TEXT_TIMEOUT_SECONDS, check=True,
+    )
+    if result.stderr:
+        print(result.stderr.decode('utf-8', 'replace').rstrip())
+    return json.loads(result.stdout)
+
+
+# 同時執行的子程序數上限由執行緒數控制；多個提取工作共用
+_text_executor = ThreadPoolExecutor(max_workers=TEXT_WORKERS, thread_name_prefix="pdf-text")
+
+
+# ==================== 文件 ====================
+
+
+class PdfDocument:
+    """單一 PDF 文件；owned 為 True 時，close() 會刪除暫存檔"""
+
+    def __init__(self, path: str, name: str = "", owned: bool = False, backend: Optional[str] = None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.owned = owned
+        self.backend = backend or DEFAULT_BACKEND
+        self._handle = None
+        self._handle_error = None
+        self._page_count = None
+        self._content_hash = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_stream(cls, stream, name: str = "", backend: Optional[str] = None) -> "PdfDocument":
+        """將檔案物件（例如 Streamlit 的 UploadedFile）分段複製到暫存檔"""
+        if hasattr(stream, 'seek'):
+            stream.seek(0)
+        fd, path = tempfile.mkstemp(suffix='.pdf', dir=SPOOL_DIR)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(stream, f, CHUNK_SIZE)
+        except BaseException:
+            # 磁碟已滿或讀取中斷時刪除寫到一半的暫存檔
+            os.remove(path)
+            raise
+        return cls(path, name or getattr(stream, 'name', ''), owned=True, backend=backend)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, name: str = "", backend: Optional[str] = None) -> "PdfDocument":
+        fd, path = tempfile.mkstemp(suffix='.pdf', dir=SPOOL_DIR)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            os.remove(path)
+            raise
+        return cls(path, name, owned=True, backend=backend)
+
+    @classmethod
+    def open(cls, pdf: Union["PdfDocument", bytes, str], name: str = "", backend: Optional[str] = None) -> "PdfDocument":
+        """接受 PdfDocument、PDF 位元組或檔案路徑；呼叫端只在回傳的物件不是傳入的物件時負責 close()"""
+        if isinstance(pdf, PdfDocument):
+            return pdf
+        if isinstance(pdf, (bytes, bytearray, memoryview)):
+            return cls.from_bytes(bytes(pdf), name, backend)
+        return cls(str(pdf), name, backend=backend)
+
+    def __enter__(self) -> "PdfDocument":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def content_hash(self) -> str:
+        """檔案內容的 SHA-1（分段讀取）；用於產生不同檔案之間不重複的題目 ID"""
+        if self._content_hash is None:
+            digest = hashlib.sha1()
+            with open(self.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            self._content_hash = digest.hexdigest()
+        return self._content_hash
+
+    def _get_handle(self):
+        """後端的文件物件；只開啟 / 解析一次，無法解析時之後的呼叫直接拋出同一個錯誤"""
+        if self._handle_error is not None:
+            raise self._handle_error
+        if self._handle is None:
+            try:
+                self._handle = open_backend(self.path, self.backend)
+            except Exception as e:
+                self._handle_error = e
+                raise
+        return self._handle
+
+    @property
+    def page_count(self) -> int:
+        with self._lock:
+            if self._page_count is None:
+                try:
+                    self._page_count = self._get_handle().page_count
+                except Exception:
+                    if self.backend == BACKEND_PYMUPDF:
+                        raise
+                    # PyPDF2 無法解析結構損毀的檔案時改問 poppler；結果保留，不必每次重新開檔
+                    from pdf2image import pdfinfo_from_path
+                    self._page_count = int(pdfinfo_from_path(self.path)['Pages'])
+            return self._page_count
+
+    def page_text(self, page_num: int) -> str:
+        """第 page_num 頁（從 1 起算）的文字層；讀取失敗時回傳空字串"""
+        with self._lock:
+            try:
+                return self._get_handle().page_text(page_num)
+            except Exception as e:
+                print(f"PDF 文字層讀取失敗（{self.name} 第 {page_num} 頁）：{e}")
+                return ""
+
+    def texts(self, workers: Optional[int] = None) -> List[str]:
+        """
+        每頁的文字層列表；PyPDF2 後端頁數多時分段交給多個子程序並行提取（各程序自行開啟暫存檔），
+        並行失敗時改為在本程序逐頁提取；workers 未指定時 PyMuPDF 後端逐頁提取
+        """
+        page_count = self.page_count
+        if workers is None:
+            workers = TEXT_WORKERS if self.backend == BACKEND_PYPDF2 else 1
+        if workers > 1 and page_count >= PARALLEL_MIN_PAGES:
+            chunk = -(-page_count // workers)
+            ranges = [(first, min(first + chunk - 1, page_count)) for first in range(1, page_count + 1, chunk)]
+            try:
+                futures = [_text_executor.submit(_page_texts_subprocess, self.path, self.backend, a, b)
+                           for a, b in ranges]
+                return [text for future in futures for text in future.result()]
+            except Exception as e:
+                print(f"並行提取文字失敗，改為逐頁提取：{e}")
+        return [self.page_text(n) for n in range(1, page_count + 1)]
+
+    def render_page(self, page_num: int, dpi: int = 200):
+        """只將第 page_num 頁轉為 PIL 圖片"""
+        with self._lock:
+            return self._get_handle().render_page(page_num, dpi)
+
+    def iter_images(self, dpi: int = 200) -> Iterator:
+        """逐頁轉圖；同一時間只有一頁的圖片在記憶體中"""
+        for page_num in range(1, self.page_count + 1):
+            yield page_num, self.render_page(page_num, dpi)
+
+    def close(self):
+        with self._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+        if self.owned and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def main(argv: Optional[List[str]] = None):
+    """子程序入口：python pdf_document.py 路徑 後端 起始頁 結束頁，以 JSON 輸出各頁文字"""
+    path, backend, first, last = argv if argv is not None else sys.argv[1:]
+    # 錯誤訊息改寫到 stderr，stdout 只留 JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        texts = _page_texts_worker(path, backend, int(first), int(last))
+    json.dump(texts, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
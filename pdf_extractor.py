@@ -5,37 +5,10 @@
 
 import re
 from typing import List, Dict, Tuple
-import PyPDF2
-from pdf2image import convert_from_bytes
 import pytesseract
 from PIL import Image
-import io
-
-# 法律科目關鍵詞
-LEGAL_SUBJECTS = {
-    '民法': ['民法', '物權', '債權', '親屬', '繼承', '契約', '買賣', '租賃', '抵押', '質權'],
-    '刑法': ['刑法', '犯罪', '故意', '過失', '搶劫', '竊盜', '詐欺', '傷害', '殺人', '強制'],
-    '民訴': ['民訴', '民事訴訟', '管轄', '訴訟', '上訴', '再審', '和解', '調解', '證據', '舉證'],
-    '刑訴': ['刑訴', '刑事訴訟', '偵查', '起訴', '審判', '證人', '被告', '檢察官', '法官'],
-    '行政法': ['行政法', '行政處分', '行政程序', '行政救濟', '訴願', '行政訴訟', '公務員'],
-    '商法': ['商法', '公司', '股份', '董事', '監察', '商人', '商業帳簿', '票據', '支票'],
-    '智財法': ['智慧財產', '著作權', '專利', '商標', '營業秘密', '積體電路'],
-    '勞動法': ['勞動法', '勞工', '雇主', '薪資', '工時', '休假', '工會', '爭議'],
-    '環保法': ['環保', '環境', '污染', '廢棄物', '空氣', '水質', '環評'],
-    '稅法': ['稅法', '所得稅', '營業稅', '關稅', '遺產稅', '贈與稅'],
-}
-
-# 題目和答案的分隔符號
-QUESTION_SEPARATORS = [
-    r'(?:^|\n)(?:【|＜|<)?(?:題目|問題|案例|例題)(?:】|＞|>)?[\s]*(?::|：)',
-    r'(?:^|\n)(?:第\s*[一二三四五六七八九十\d]+\s*題)',
-    r'(?:^|\n)(?:Q\d+|q\d+)',
-]
-
-ANSWER_SEPARATORS = [
-    r'(?:^|\n)(?:【|＜|<)?(?:答案|解答|參考解答|說明)(?:】|＞|>)?[\s]*(?::|：)',
-    r'(?:^|\n)(?:【|＜|<)?(?:解|答)(?:】|＞|>)?[\s]*(?::|：)',
-]
+from legal_keywords import LEGAL_SUBJECTS, QUESTION_SEPARATORS, ANSWER_SEPARATORS
+from pdf_document import PdfDocument
 
 class LegalPDFExtractor:
     """法律題目 PDF 提取器"""
@@ -43,18 +16,24 @@ class LegalPDFExtractor:
     def __init__(self):
         self.subjects = LEGAL_SUBJECTS
     
-    def extract_text_from_pdf(self, pdf_bytes: bytes) -> str:
+    def extract_text_from_pdf(self, pdf) -> str:
         """
-        從 PDF 提取文字
-        優先使用 PyPDF2（快速），失敗則使用 OCR（準確）
+        從 PDF（PdfDocument、位元組或路徑）提取文字
+        優先使用 PyPDF2（快速），失敗則使用 OCR（準確）；兩者共用同一個已解析的文件
         """
+        document = PdfDocument.open(pdf)
+        try:
+            return self._extract_text(document)
+        finally:
+            if document is not pdf:
+                document.close()
+    
+    def _extract_text(self, document: PdfDocument) -> str:
         text = ""
         
         # 方法 1：使用 PyPDF2（快速）
         try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+            text = "".join(page_text + "\n" for page_text in document.texts())
             
             # 如果提取成功且內容充足，直接返回
             if len(text.strip()) > 50:
@@ -62,12 +41,13 @@ class LegalPDFExtractor:
         except Exception as e:
             print(f"PyPDF2 提取失敗：{e}")
         
-        # 方法 2：使用 OCR（準確但較慢）
+        # 方法 2：使用 OCR（準確但較慢），逐頁轉圖
         try:
-            images = convert_from_bytes(pdf_bytes)
-            for image in images:
-                text += pytesseract.image_to_string(image, lang='chi_tra') + "\n"
-            return text
+            ocr_text = [
+                pytesseract.image_to_string(image, lang='chi_tra') + "\n"
+                for _, image in document.iter_images()
+            ]
+            return text + "".join(ocr_text)
         except Exception as e:
             print(f"OCR 提取失敗：{e}")
             return ""
@@ -134,12 +114,12 @@ class LegalPDFExtractor:
         
         return qa_pairs
     
-    def extract_questions(self, pdf_bytes: bytes, filename: str = "") -> List[Dict]:
+    def extract_questions(self, pdf, filename: str = "") -> List[Dict]:
         """
         完整的題目提取流程
         """
         # 步驟 1：提取文字
-        text = self.extract_text_from_pdf(pdf_bytes)
+        text = self.extract_text_from_pdf(pdf)
         
         if not text or len(text.strip()) < 50:
             return []
@@ -0,0 +1,172 @@
+"""
+程序內共用的精簡題庫
+科目 / 類型以類別代碼儲存、分數以 float32 陣列儲存（保留 2.5 分等小數）、文字欄位以 Arrow 字串儲存；
+各工作階段只保留索引陣列，不再各自複製一份 DataFrame
+"""
+
+import hashlib
+import threading
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+REQUIRED_COLUMNS = ['ID', '類型', '科目', '題目內容', '參考解答', '分數']
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+
+
+def format_score(value) -> str:
+    """10.0 → "10"、2.5 → "2.5" """
+    return f"{float(value):g}"
+
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+def _content_token(df: pd.DataFrame) -> str:
+    columns = REQUIRED_COLUMNS + (['來源'] if '來源' in df.columns else [])
+    row_hashes = pd.util.hash_pandas_object(df[columns].astype(str), index=False)
+    return hashlib.sha1(row_hashes.to_numpy().tobytes()).hexdigest()
+
+
+class QuestionBank:
+    """不可變的題庫；建立後所有工作階段共用同一個實例"""
+
+    def __init__(self, df: pd.DataFrame):
+        subjects = pd.Categorical(df['科目'].fillna('').astype(str))
+        types = pd.Categorical(df['類型'].fillna('').astype(str))
+
+        self.subjects: List[str] = list(subjects.categories)
+        self.types: List[str] = list(types.categories)
+        self.subject_codes = _readonly(np.asarray(subjects.codes, dtype=np.int16))
+        self.type_codes = _readonly(np.asarray(types.codes, dtype=np.int16))
+        # 載入題庫時發現的資料問題，由 app 顯示
+        self.warnings: List[str] = []
+
+        scores = pd.to_numeric(df['分數'], errors='coerce')
+        invalid = scores.isna()
+        if invalid.any():
+            ids = df.loc[invalid, 'ID'].astype(str).tolist()
+            self.warnings.append(
+                f"{len(ids)} 題的分數空白或不是數字，已視為 0 分：{'、'.join(ids[:10])}{' 等' if len(ids) > 10 else ''}"
+            )
+        self.scores = _readonly(scores.fillna(0).to_numpy(dtype=np.float32))
+
+        # 多試算表合併時記錄每題的來源
+        sources = pd.Categorical(df['來源'].astype(str) if '來源' in df.columns else [''] * len(df))
+        self.sources: List[str] = list(sources.categories)
+        self.source_codes = _readonly(np.asarray(sources.codes, dtype=np.int16))
+
+        self.ids = pd.array(df['ID'].astype(str), dtype=STRING_DTYPE)
+        self.texts = pd.array(df['題目內容'].fillna('').astype(str), dtype=STRING_DTYPE)
+        self.answers = pd.array(df['參考解答'].fillna('').astype(str), dtype=STRING_DTYPE)
+
+        # 由內容計算的識別碼，用來判斷工作階段中的索引是否仍然有效；
+        # 重新載入但內容未變時識別碼相同，已生成的考卷仍然有效
+        self.token = _content_token(df)
+
+        self._similarity = None
+        self._similarity_lock = threading.Lock()
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "QuestionBank":
+        missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+        if missing:
+            raise ValueError(f"試算表缺少必要欄位。需要：{', '.join(REQUIRED_COLUMNS)}")
+        return cls(df.reset_index(drop=True))
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    @property
+    def total_score(self) -> float:
+        return round(float(self.scores.sum(dtype=np.float64)), 3)
+
+    @property
+    def nbytes(self) -> int:
+        """題庫佔用的大約位元組數"""
+        arrays = [self.subject_codes, self.type_codes, self.source_codes, self.scores]
+        strings = [self.ids, self.texts, self.answers]
+        return sum(a.nbytes for a in arrays) + sum(s.nbytes for s in strings)
+
+    @property
+    def similarity(self):
+        """題目內容的相似度索引；第一次使用時建立，之後隨題庫共用"""
+        with self._similarity_lock:
+            if self._similarity is None:
+                from question_similarity import SimilarityIndex
+                self._similarity = SimilarityIndex(pd.Series(self.texts, copy=False).fillna('').tolist())
+            return self._similarity
+
+    @property
+    def similarity_ready(self) -> bool:
+        return self._similarity is not None
+
+    def find_id(self, question_id: str) -> Optional[int]:
+        """以 ID 找出題目的索引；找不到時回傳 None"""
+        matches = np.flatnonzero((pd.Series(self.ids, copy=False) == question_id).to_numpy(dtype=bool, na_value=False))
+        return int(matches[0]) if len(matches) else None
+
+    def select(self, subjects: Optional[Sequence[str]] = None, types: Optional[Sequence[str]] = None,
+               keyword: str = "") -> np.ndarray:
+        """依科目、類型與關鍵字篩選，回傳符合條件的索引陣列（None 表示不限）"""
+        mask = np.ones(len(self), dtype=bool)
+
+        if subjects is not None:
+            codes = [self.subjects.index(s) for s in subjects if s in self.subjects]
+            mask &= np.isin(self.subject_codes, codes)
+
+        if types is not None:
+            codes = [self.types.index(t) for t in types if t in self.types]
+            mask &= np.isin(self.type_codes, codes)
+
+        if keyword:
+            texts = pd.Series(self.texts, copy=False)
+            ids = pd.Series(self.ids, copy=False)
+            mask &= (
+                texts.str.contains(keyword, regex=False).to_numpy(dtype=bool, na_value=False) |
+                ids.str.contains(keyword, regex=False).to_numpy(dtype=bool, na_value=False)
+            )
+
+        return np.flatnonzero(mask).astype(np.int32)
+
+    def take(self, indices: Sequence[int]) -> pd.DataFrame:
+        """將指定索引的題目組成 DataFrame（只用於顯示或匯出少量題目）"""
+        indices = np.asarray(indices, dtype=np.int64)
+        df = pd.DataFrame({
+            'ID': self.ids.take(indices),
+            '類型': pd.Categorical.from_codes(self.type_codes[indices], self.types),
+            '科目': pd.Categorical.from_codes(self.subject_codes[indices], self.subjects),
+            '題目內容': self.texts.take(indices),
+            '參考解答': self.answers.take(indices),
+            '分數': _compact_scores(self.scores[indices]),
+        })
+        if len(self.sources) > 1:
+            df['來源'] = pd.Categorical.from_codes(self.source_codes[indices], self.sources)
+        return df
+
+    def to_frame(self) -> pd.DataFrame:
+        return self.take(np.arange(len(self)))
+
+    def subject_counts(self, indices: Optional[np.ndarray] = None) -> pd.Series:
+        codes = self.subject_codes if indices is None else self.subject_codes[indices]
+        return pd.Series(np.bincount(codes, minlength=len(self.subjects)), index=self.subjects)
+
+    def type_counts(self, indices: Optional[np.ndarray] = None) -> pd.Series:
+        codes = self.type_codes if indices is None else self.type_codes[indices]
+        return pd.Series(np.bincount(codes, minlength=len(self.types)), index=self.types)
+
+
+def _compact_scores(scores: np.ndarray) -> np.ndarray:
+    """分數全為整數時以整數顯示 / 匯出（10 而不是 10.0），否則保留小數"""
+    scores = np.round(scores.astype(np.float64), 3)  # 去除 float32 的尾數誤差（0.1 → 0.1000000015）
+    if np.all(scores == np.round(scores)):
+        return scores.astype(np.int64)
+    return scores
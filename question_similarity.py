@@ -0,0 +1,123 @@
+"""
+題目內容相似度
+以字元 n-gram 的 TF-IDF 稀疏矩陣表示每題的題目內容，用於查詢相似題目，
+以及出卷時避免同一張考卷出現主題太接近的題目（例如兩題抵押權案例）
+建立與查詢都以 numpy / scipy 稀疏矩陣運算完成，題庫十萬題時仍可即時查詢
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+NGRAM_SIZES = (2,)     # 中文以字元二元組為主；加入 3 會讓索引大小約增為兩倍
+N_FEATURES = 1 << 20   # n-gram 以雜湊對應到固定維度，不需保存詞彙表
+CHUNK_DOCS = 20000     # 分批建立，避免一次將所有題目轉成字元陣列
+
+# 不參與 n-gram 的字元：空白、全形空白與常見標點
+_IGNORED = np.array(sorted(set(map(ord, " \t\r\n　，。、；：？！「」『』（）()［］[]〔〕,.;:?!-－—…"))),
+                    dtype=np.uint32)
+
+
+def _char_codes(texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """將多段文字轉為 (字元碼, 所屬題號) 兩個陣列，並去除空白與標點"""
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    codes = np.frombuffer("".join(texts).encode('utf-32-le'), dtype=np.uint32)
+    docs = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    keep = ~np.isin(codes, _IGNORED)
+    return codes[keep], docs[keep]
+
+
+def _ngram_counts(texts: Sequence[str]) -> sparse.csr_matrix:
+    """一批題目的 n-gram 次數矩陣（列為題目、欄為 n-gram 雜湊）"""
+    n_docs = len(texts)
+    codes, docs = _char_codes([t.lower() for t in texts])
+    rows, cols = [], []
+    for n in NGRAM_SIZES:
+        if len(codes) < n:
+            continue
+        span = len(codes) - n + 1
+        # 只保留整個視窗都在同一題內的 n-gram
+        valid = docs[:span] == docs[n - 1:n - 1 + span]
+        hashed = np.full(span, n, dtype=np.uint64)
+        for i in range(n):
+            hashed = hashed * np.uint64(1000003) ^ codes[i:i + span].astype(np.uint64)
+        rows.append(docs[:span][valid])
+        cols.append((hashed[valid] % np.uint64(N_FEATURES)).astype(np.int64))
+
+    if not rows:
+        return sparse.csr_matrix((n_docs, N_FEATURES), dtype=np.float32)
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    counts = sparse.coo_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n_docs, N_FEATURES))
+    return counts.tocsr()
+
+
+class SimilarityIndex:
+    """
+    題目內容的 TF-IDF 倒排索引（以欄存取的稀疏矩陣），查詢時只碰到與查詢題目共有 n-gram 的題目
+    只出現在一題中的 n-gram 對題庫中任兩題的相似度都沒有貢獻，不保存，題庫內兩題的分數仍是精確的餘弦相似度；
+    以題庫外的文字查詢時，與只出現在一題中的 n-gram 相符的部分不計入，分數可能略低
+    """
+
+    def __init__(self, texts: Sequence[str]):
+        texts = ["" if t is None else str(t) for t in texts]
+        self.n_docs = n_docs = len(texts)
+
+        chunks = [_ngram_counts(texts[start:start + CHUNK_DOCS]) for start in range(0, n_docs, CHUNK_DOCS)]
+        counts = sparse.vstack(chunks, format='csr') if chunks else sparse.csr_matrix((0, N_FEATURES), dtype=np.float32)
+
+        # 次線性 TF 與平滑 IDF
+        df = np.bincount(counts.indices, minlength=N_FEATURES)
+        self.idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+        counts.data = np.log1p(counts.data) * self.idf[counts.indices]
+
+        # 以完整向量計算長度，略去只出現在一題中的 n-gram 後，題庫內兩題的內積仍是原本的餘弦相似度
+        norms = np.sqrt(np.asarray(counts.multiply(counts).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        counts = sparse.csr_matrix(sparse.diags((1 / norms).astype(np.float32)) @ counts)
+
+        counts.data[df[counts.indices] < 2] = 0
+        counts.eliminate_zeros()
+        self._columns = counts.tocsc()
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    @property
+    def nbytes(self) -> int:
+        m = self._columns
+        return m.data.nbytes + m.indices.nbytes + m.indptr.nbytes + self.idf.nbytes
+
+    def vectorize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """將任意文字轉為 (n-gram 欄位, 正規化權重)"""
+        row = _ngram_counts([text or ""])
+        weights = np.log1p(row.data) * self.idf[row.indices]
+        norm = np.sqrt((weights * weights).sum())
+        return row.indices, (weights / norm if norm else weights)
+
+    def similarities_to_text(self, text: str) -> np.ndarray:
+        """任意文字與所有題目的餘弦相似度"""
+        columns, weights = self.vectorize(text)
+        if len(columns) == 0:
+            return np.zeros(len(self), dtype=np.float32)
+        return np.asarray(self._columns[:, columns] @ weights).ravel()
+
+    def most_similar(self, text: str, k: int = 10, candidates: Optional[np.ndarray] = None,
+                     exclude: Optional[int] = None, min_similarity: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """回傳與 text 最相似的 k 題 (索引, 相似度)；exclude 可排除查詢題目本身"""
+        scores = self.similarities_to_text(text)
+        if exclude is not None:
+            scores[exclude] = -1
+        if candidates is not None:
+            mask = np.zeros(len(self), dtype=bool)
+            mask[candidates] = True
+            scores[~mask] = -1
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.array([], dtype=np.int32), np.array([], dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[scores[top] > max(min_similarity, 0)]
+        return top.astype(np.int32), scores[top]
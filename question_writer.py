@@ -0,0 +1,242 @@
+"""
+將提取的題目寫回題庫
+以 ID 為鍵比對現有題目，產生差異（新增 / 更新 / 不變），可先預覽再分批寫入；
+更新只比對與寫入必要欄位，試算表中其他欄位（例如老師自行加的備註）保持不變；
+寫入目標可為 Google Sheets API 或本機 CSV 檔
+"""
+
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+import requests
+
+from question_bank import REQUIRED_COLUMNS
+from sheet_loader import get_http_session
+
+# Google Sheets API 位址；可指向本機模擬伺服器進行測試
+SHEETS_API_URL = os.environ.get('SHEETS_API_URL', 'https://sheets.googleapis.com/v4')
+
+BATCH_SIZE = 500
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF = 1.0
+
+MODE_APPEND = 'append'  # 只新增題庫中沒有的 ID
+MODE_UPSERT = 'upsert'  # 新增並更新已存在的 ID
+
+
+class WritePlan:
+    """寫入前的差異結果"""
+
+    def __init__(self, header: List[str], appends: pd.DataFrame, updates: pd.DataFrame, unchanged: int,
+                 mode: str = MODE_UPSERT):
+        self.header = header
+        self.appends = appends      # 要新增的題目
+        self.updates = updates      # 要更新的題目（只含必要欄位），_row 欄為試算表中的列號（從 1 起算，含標題列）
+        self.unchanged = unchanged  # 只新增模式下為題庫中已存在而略過的題數
+        self.mode = mode
+
+    @property
+    def empty(self) -> bool:
+        return self.appends.empty and self.updates.empty
+
+    def summary(self) -> Dict[str, int]:
+        if self.mode == MODE_APPEND:
+            return {'新增': len(self.appends), '更新': 0, '已存在（略過）': self.unchanged}
+        return {'新增': len(self.appends), '更新': len(self.updates), '不變': self.unchanged}
+
+
+# ==================== 寫入目標 ====================
+class SheetsAPIStore:
+    """透過 Google Sheets API v4 讀寫第一個工作表"""
+
+    def __init__(self, sheet_id: str, token: Optional[str] = None, base_url: str = SHEETS_API_URL):
+        self.sheet_id = sheet_id
+        self.token = token or os.environ.get('GOOGLE_SHEETS_TOKEN')
+        self.base_url = base_url.rstrip('/')
+        if not self.token:
+            raise ValueError("Google Sheets 寫入權杖未設定。請設定 GOOGLE_SHEETS_TOKEN 環境變數。")
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/spreadsheets/{self.sheet_id}/{path}"
+
+    def _request(self, method: str, path: str, **kwargs) -> Dict:
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = get_http_session().request(method, self._url(path), headers=headers, timeout=60, **kwargs)
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    def read(self) -> pd.DataFrame:
+        values = self._request('GET', 'values/A1:ZZ').get('values', [])
+        if not values:
+            return pd.DataFrame(columns=REQUIRED_COLUMNS)
+        header, rows = values[0], values[1:]
+        rows = [row + [''] * (len(header) - len(row)) for row in rows]
+        return pd.DataFrame(rows, columns=header)
+
+    def append(self, header: List[str], rows: pd.DataFrame):
+        self._request(
+            'POST', 'values/A1:ZZ:append',
+            params={'valueInputOption': 'RAW', 'insertDataOption': 'INSERT_ROWS'},
+            json={'values': _to_values(rows, header)},
+        )
+
+    def update(self, header: List[str], rows: pd.DataFrame, columns: List[str] = REQUIRED_COLUMNS):
+        """只寫入 columns 所在的儲存格；不相鄰的欄位分成多個範圍"""
+        data = []
+        for first, last in _column_runs(header, columns):
+            run_columns = header[first:last + 1]
+            data += [
+                {'range': f"{_column_letter(first + 1)}{row_number}:{_column_letter(last + 1)}{row_number}",
+                 'values': [values]}
+                for row_number, values in zip(rows['_row'], _to_values(rows, run_columns))
+            ]
+        self._request('POST', 'values:batchUpdate', json={'valueInputOption': 'RAW', 'data': data})
+
+
+class CsvStore:
+    """以本機 CSV 檔代替試算表（無 API 權杖時使用）"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self) -> pd.DataFrame:
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=REQUIRED_COLUMNS)
+        return pd.read_csv(self.path, dtype=str, keep_default_na=False)
+
+    def _write(self, df: pd.DataFrame):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+
+    def append(self, header: List[str], rows: pd.DataFrame):
+        df = self.read().reindex(columns=header)
+        self._write(pd.concat([df, rows.reindex(columns=header).astype(str)], ignore_index=True))
+
+    def update(self, header: List[str], rows: pd.DataFrame, columns: List[str] = REQUIRED_COLUMNS):
+        df = self.read().reindex(columns=header)
+        for row_number, values in zip(rows['_row'], _to_values(rows, columns)):
+            df.loc[row_number - 2, columns] = values  # 扣除標題列與 1 起算
+        self._write(df)
+
+
+def open_store(sheet_id: str, local_dir: Optional[str] = None):
+    """有 API 權杖時寫入 Google Sheets，否則寫入 local_dir 下的 CSV 檔"""
+    local_dir = local_dir or os.environ.get('QUESTION_STORE_DIR')
+    if local_dir:
+        return CsvStore(os.path.join(local_dir, f"{sheet_id}.csv"))
+    return SheetsAPIStore(sheet_id)
+
+
+# ==================== 差異與寫入 ====================
+def plan_write(existing: pd.DataFrame, new_questions: pd.DataFrame, mode: str = MODE_UPSERT) -> WritePlan:
+    """
+    比對現有題庫與新題目，產生寫入計畫（不修改任何資料，可作為預覽）
+    新題目中有重複的 ID 時拋出 ValueError，不會默默只保留其中一題
+    """
+    header = list(existing.columns) if len(existing.columns) else list(REQUIRED_COLUMNS)
+    header += [c for c in REQUIRED_COLUMNS if c not in header]
+
+    new = new_questions.reindex(columns=header).fillna('').astype(str)
+    duplicated = new.loc[new['ID'].duplicated(keep=False), 'ID'].unique().tolist()
+    if duplicated:
+        raise ValueError(
+            f"新題目中有 {len(duplicated)} 個重複的 ID：{'、'.join(duplicated[:10])}{' 等' if len(duplicated) > 10 else ''}"
+        )
+
+    current = existing.reindex(columns=header).fillna('').astype(str)
+    current['_row'] = range(2, len(current) + 2)
+    current = current.drop_duplicates(subset='ID', keep='first').set_index('ID')
+
+    is_new = ~new['ID'].isin(current.index)
+    appends = new[is_new].reset_index(drop=True)
+
+    if mode == MODE_APPEND:
+        return WritePlan(header, appends, pd.DataFrame(columns=REQUIRED_COLUMNS + ['_row']), int((~is_new).sum()),
+                         mode=MODE_APPEND)
+
+    # 只比對必要欄位；新題目沒有的其他欄位不視為變更，也不會被寫成空白
+    compare_columns = [c for c in REQUIRED_COLUMNS if c != 'ID']
+    existing_rows = new.loc[~is_new, REQUIRED_COLUMNS].set_index('ID')
+    changed = (existing_rows[compare_columns] != current.loc[existing_rows.index, compare_columns]).any(axis=1)
+
+    updates = existing_rows[changed].reset_index()
+    updates['_row'] = current.loc[updates['ID'], '_row'].to_numpy()
+    return WritePlan(header, appends, updates, int((~changed).sum()))
+
+
+def apply_plan(store, plan: WritePlan, batch_size: int = BATCH_SIZE,
+               progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
+    """
+    分批執行寫入計畫，失敗的批次會重試；
+    新增批次重試前會重新讀取題庫，略過已寫入成功的 ID，重複執行不會產生重複題目
+    """
+    total = len(plan.appends) + len(plan.updates)
+    done = 0
+    written = {'新增': 0, '更新': 0}
+
+    for start in range(0, len(plan.updates), batch_size):
+        batch = plan.updates.iloc[start:start + batch_size]
+        _with_retry(lambda: store.update(plan.header, batch))
+        done += len(batch)
+        written['更新'] += len(batch)
+        if progress:
+            progress(done, total)
+
+    for start in range(0, len(plan.appends), batch_size):
+        batch = plan.appends.iloc[start:start + batch_size]
+
+        def append_missing(attempt: int):
+            pending = batch
+            if attempt > 0:
+                present = set(store.read()['ID'].astype(str))
+                pending = batch[~batch['ID'].isin(present)]
+            if not pending.empty:
+                store.append(plan.header, pending)
+
+        _with_retry(append_missing, pass_attempt=True)
+        done += len(batch)
+        written['新增'] += len(batch)
+        if progress:
+            progress(done, total)
+
+    return written
+
+
+def _with_retry(fn, pass_attempt: bool = False):
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return fn(attempt) if pass_attempt else fn()
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            retryable = status is None or status == 429 or status >= 500
+            if not retryable or attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+
+def _to_values(rows: pd.DataFrame, header: List[str]) -> List[List[str]]:
+    return rows.reindex(columns=header).fillna('').astype(str).values.tolist()
+
+
+def _column_runs(header: List[str], columns: List[str]) -> List[Tuple[int, int]]:
+    """columns 在 header 中的位置，合併為連續的 (起, 迄) 區段（從 0 起算）"""
+    positions = sorted(header.index(c) for c in columns)
+    runs = []
+    for position in positions:
+        if runs and position == runs[-1][1] + 1:
+            runs[-1][1] = position
+        else:
+            runs.append([position, position])
+    return [(first, last) for first, last in runs]
+
+
+def _column_letter(n: int) -> str:
+    letters = ''
+    while n:
+        n, remainder = divmod(n - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
@@ -0,0 +1,266 @@
+"""
+重跑與背景提取的效能剖析（選用）
+設定環境變數 EXAM_PROFILE_DIR 後，每次 app.py 重跑與每個背景提取工作都會被剖析：
+- 取樣呼叫堆疊，輸出 collapsed stacks（.folded，可直接交給 flamegraph.pl、speedscope）
+- 同時以 cProfile 輸出 .prof（可用 snakeviz 或 pstats 檢視）
+- 每筆紀錄附上工作階段、題庫大小與動作（.json），目錄中只保留最慢的 PROFILE_KEEP 筆
+
+用法：
+    EXAM_PROFILE_DIR=/tmp/exam-profiles streamlit run app.py
+    python run_profiler.py /tmp/exam-profiles        # 列出目前保留的最慢紀錄
+"""
+
+import cProfile
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+PROFILE_DIR = os.environ.get('EXAM_PROFILE_DIR')
+PROFILE_KEEP = int(os.environ.get('EXAM_PROFILE_KEEP', 20))
+
+# 取樣間隔（秒）；cProfile 會讓純 Python 程式碼變慢，可設 EXAM_PROFILE_CPROFILE=0 只保留取樣
+SAMPLE_INTERVAL = float(os.environ.get('EXAM_PROFILE_INTERVAL', 0.005))
+USE_CPROFILE = os.environ.get('EXAM_PROFILE_CPROFILE', '1') != '0'
+
+
+def enabled() -> bool:
+    return bool(PROFILE_DIR)
+
+
+# ==================== 單次剖析 ====================
+class ProfiledRun:
+    """一次重跑或一個提取工作的剖析資料"""
+
+    def __init__(self, kind: str, tags: Dict):
+        self.kind = kind
+        self.tags = dict(tags)
+        self.actions: List[str] = []
+        self.status = 'ok'
+        self.samples: Counter = Counter()
+        self.thread_id = threading.get_ident()
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.profile = None
+
+        if USE_CPROFILE:
+            try:
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+            except ValueError:
+                # Python 3.12 起同一時間只能有一個 cProfile；其他執行緒正在剖析時只取樣
+                self.profile = None
+
+    def tag(self, action: Optional[str] = None, **tags):
+        if action and action not in self.actions:
+            self.actions.append(action)
+        self.tags.update(tags)
+
+    @property
+    def action(self) -> str:
+        return '+'.join(self.actions) or self.kind
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self.started
+        if self.profile is not None:
+            self.profile.disable()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+# ==================== 取樣 ====================
+_active: Dict[int, ProfiledRun] = {}  # 執行緒 ID → 進行中的剖析
+_lock = threading.Lock()
+_wake = threading.Event()
+_sampler = None
+
+
+def _sample_loop():
+    """所有進行中的剖析共用一個取樣執行緒"""
+    while True:
+        with _lock:
+            runs = list(_active.values())
+        if not runs:
+            _wake.wait()
+            _wake.clear()
+            continue
+
+        frames = sys._current_frames()
+        for run in runs:
+            frame = frames.get(run.thread_id)
+            if frame is None:
+                # 執行緒已結束但未呼叫 finish()：重跑中途拋出例外，正是最需要保留的紀錄；
+                # _save 會停止 cProfile（Python 3.12 起全程序只能有一個，不停止之後的剖析都無法啟用）
+                with _lock:
+                    if _active.get(run.thread_id) is not run:
+                        continue
+                    del _active[run.thread_id]
+                run.status = 'error'
+                _save(run)
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            run.samples[';'.join(reversed(stack))] += 1
+        del frames
+        time.sleep(SAMPLE_INTERVAL)
+
+
+def _ensure_sampler():
+    global _sampler
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_loop, name="run-profiler", daemon=True)
+            _sampler.start()
+
+
+def start(kind: str, **tags) -> Optional[ProfiledRun]:
+    """開始剖析目前執行緒；未啟用時回傳 None"""
+    if not enabled():
+        return None
+
+    thread_id = threading.get_ident()
+    with _lock:
+        previous = _active.pop(thread_id, None)
+    if previous is not None:
+        # 同一執行緒上一次重跑沒有走到 finish()：使用者在重跑途中又操作了頁面
+        previous.status = 'interrupted'
+        _save(previous)
+
+    run = ProfiledRun(kind, tags)
+    _ensure_sampler()
+    with _lock:
+        _active[thread_id] = run
+    _wake.set()
+    return run
+
+
+def finish(run: Optional[ProfiledRun]):
+    if run is None:
+        return
+    with _lock:
+        if _active.get(run.thread_id) is not run:
+            return
+        del _active[run.thread_id]
+    _save(run)
+
+
+def tag(action: Optional[str] = None, **tags):
+    """為目前執行緒的剖析加上動作或標籤（例如 bank_size）；未剖析時不做事"""
+    run = _active.get(threading.get_ident())
+    if run is not None:
+        run.tag(action, **tags)
+
+
+@contextmanager
+def profiled(kind: str, **tags):
+    run = start(kind, **tags)
+    try:
+        yield run
+    except BaseException:
+        if run is not None:
+            run.status = 'error'
+        raise
+    finally:
+        finish(run)
+
+
+# ==================== 儲存與輪替 ====================
+_save_lock = threading.Lock()
+
+
+def _stem(path: str) -> str:
+    return path[:-len('.json')]
+
+
+def _kept_runs(directory: str) -> List[Dict]:
+    runs = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta['_stem'] = _stem(path)
+        runs.append(meta)
+    return runs
+
+
+def _remove(stem: str):
+    for suffix in ('.json', '.folded', '.prof'):
+        try:
+            os.remove(stem + suffix)
+        except OSError:
+            pass
+
+
+def _save(run: ProfiledRun):
+    """寫入剖析結果；目錄已滿且這次比保留中最快的一筆還快時不寫入"""
+    run.stop()
+    directory = PROFILE_DIR
+    try:
+        with _save_lock:
+            os.makedirs(directory, exist_ok=True)
+            kept = sorted(_kept_runs(directory), key=lambda m: m['seconds'])
+            if len(kept) >= PROFILE_KEEP and run.seconds <= kept[0]['seconds']:
+                return
+
+            name = re.sub(r'[^\w.-]+', '_', f"{run.started_at:%Y%m%d-%H%M%S-%f}-{run.kind}-{run.action}")
+            stem = os.path.join(directory, name)
+            with open(stem + '.folded', 'w', encoding='utf-8') as f:
+                # 最外層加上「種類:動作」，合併多個檔案畫火焰圖時仍可區分
+                root = f"{run.kind}:{run.action}".replace(';', ',')
+                # 先複製：取樣執行緒可能仍在寫入最後一筆
+                samples = Counter(dict(run.samples))
+                for stack, count in samples.most_common():
+                    f.write(f"{root};{stack} {count}\n")
+            if run.profile is not None:
+                run.profile.dump_stats(stem + '.prof')
+            meta = {
+                'kind': run.kind,
+                'action': run.action,
+                'status': run.status,
+                'seconds': round(run.seconds, 4),
+                'started_at': run.started_at.isoformat(timespec='milliseconds'),
+                'samples': sum(samples.values()),
+                'tags': run.tags,
+            }
+            with open(stem + '.json', 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, default=str)
+
+            kept.append({**meta, '_stem': stem})
+            kept.sort(key=lambda m: m['seconds'])
+            for old in kept[:max(0, len(kept) - PROFILE_KEEP)]:
+                _remove(old['_stem'])
+    except Exception as e:
+        print(f"效能剖析結果寫入失敗：{e}")
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+    parser = argparse.ArgumentParser(description="列出保留的最慢重跑 / 提取紀錄")
+    parser.add_argument('directory', nargs='?', default=PROFILE_DIR)
+    args = parser.parse_args(argv)
+    if not args.directory:
+        parser.error("請指定剖析目錄或設定 EXAM_PROFILE_DIR")
+
+    for meta in sorted(_kept_runs(args.directory), key=lambda m: -m['seconds']):
+        tags = ' '.join(f"{k}={v}" for k, v in meta.get('tags', {}).items())
+        print(f"{meta['seconds']:>8.3f}s  {meta['kind']:<10} {meta['action']:<24} {meta['status']:<11} {tags}  "
+              f"{os.path.basename(meta['_stem'])}.folded")
+
+
+if __name__ == '__main__':
+    main()
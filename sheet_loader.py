@@ -0,0 +1,129 @@
+"""
+Google Sheets 題庫載入
+支援一次載入多個試算表：以連線池並行下載、統一驗證欄位，合併時處理 ID 衝突並記錄來源
+"""
+
+import io
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from question_bank import REQUIRED_COLUMNS
+
+# 試算表 CSV 匯出網址；可用環境變數指向本機替身（例如壓力測試）
+SHEETS_EXPORT_URL = os.environ.get(
+    'SHEETS_EXPORT_URL',
+    'https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv'
+)
+
+MAX_WORKERS = 12
+REQUEST_TIMEOUT = 60
+
+# ID 衝突處理方式
+COLLISION_PREFIX = 'prefix'  # 後出現的題目改為「來源:ID」
+COLLISION_FIRST = 'first'    # 保留第一個出現的題目
+COLLISION_ERROR = 'error'    # 直接報錯
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """取得共用的 HTTP session；連線池讓多次下載重用 keep-alive 連線"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=MAX_WORKERS,
+                max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def parse_sheet_ids(text: str) -> List[str]:
+    """從輸入文字解析試算表 ID（以逗號、空白或換行分隔，也接受完整網址），保留順序並去除重複"""
+    ids = []
+    for token in re.split(r'[\s,，]+', text or ''):
+        if not token:
+            continue
+        match = re.search(r'/spreadsheets/d/([\w-]+)', token)
+        sheet_id = match.group(1) if match else token
+        if sheet_id not in ids:
+            ids.append(sheet_id)
+    return ids
+
+
+def fetch_sheet(sheet_id: str) -> pd.DataFrame:
+    """下載單一試算表的 CSV"""
+    response = get_http_session().get(SHEETS_EXPORT_URL.format(sheet_id=sheet_id), timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return pd.read_csv(io.BytesIO(response.content))
+
+
+def load_sheets(sheet_ids: Sequence[str], collision: str = COLLISION_PREFIX) -> pd.DataFrame:
+    """
+    並行下載多個試算表並合併為一個題庫
+    合併後的「來源」欄記錄每題來自哪個試算表
+    """
+    if not sheet_ids:
+        raise ValueError("請至少輸入一個 Google Sheets ID")
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(sheet_ids))) as executor:
+        futures = [executor.submit(fetch_sheet, sheet_id) for sheet_id in sheet_ids]
+
+    frames = []
+    errors = []
+    for sheet_id, future in zip(sheet_ids, futures):
+        try:
+            df = future.result()
+        except Exception as e:
+            errors.append(f"{sheet_id}：{e}")
+            continue
+
+        missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+        if missing:
+            errors.append(f"{sheet_id}：缺少欄位 {', '.join(missing)}")
+            continue
+
+        df = df[REQUIRED_COLUMNS].copy()
+        df['ID'] = df['ID'].astype(str)
+        df['來源'] = sheet_id
+        frames.append(df)
+
+    if errors:
+        raise ValueError("以下試算表載入失敗：" + "；".join(errors))
+
+    merged = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    return resolve_id_collisions(merged, collision)
+
+
+def resolve_id_collisions(df: pd.DataFrame, collision: str = COLLISION_PREFIX) -> pd.DataFrame:
+    """處理不同來源之間重複的 ID（同一來源內的重複維持原狀）"""
+    first_source = df.groupby('ID', sort=False)['來源'].transform('first')
+    clashes = df['來源'] != first_source
+
+    if not clashes.any():
+        return df
+
+    if collision == COLLISION_ERROR:
+        clashed = ', '.join(df.loc[clashes, 'ID'].unique()[:10])
+        raise ValueError(f"不同試算表之間有重複的 ID：{clashed}")
+
+    if collision == COLLISION_FIRST:
+        return df[~clashes].reset_index(drop=True)
+
+    df = df.copy()
+    df.loc[clashes, 'ID'] = df.loc[clashes, '來源'] + ':' + df.loc[clashes, 'ID']
+    return df